@@ -0,0 +1,317 @@
+'''Offline benchmark of the pipeline on a synthetic corpus, so changes can be measured without running the games.
+
+Generates BL2 and TPS class defs with the shapes the real dumps have (deep class and struct hierarchies, nested
+structs, fixed arrays, out and optional params, enums, delegates) and times each stage:
+    generate, ir_write, ir_read, merge, resolve, render, write_stubs, ast_parse
+ast_parse parses every written stub, standing in for the work a type checker does to load the tree, and the size of
+the tree on disk is in the counts. Use --compact to measure write_stubs' compact function mode.
+Results are written as JSON with the best time of each stage and its traced memory high-water mark. Pass a previous
+result to --compare to check for regressions.
+'''
+import argparse
+import ast
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable
+
+from .common_class_defs import create_common_class_defs
+from .definitions import TYPE_STR_CACHE, ClassDef, Context, EnumDef, FunctionDef, NameResolver, ParamRef, PropertyRef, \
+    ReturnRef, StructDef, TypeCat, TypeRef
+from .game import Game
+from .ir_file import read_ir, write_ir
+from .runner import register_module
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PACKAGES = ['Core', 'Engine', 'GameFramework', 'GearboxFramework', 'WillowGame', 'OnlineSubsystemSteamworks']
+BUILTIN_TYPES = ['int', 'float', 'bool', 'str']
+FIXED_ARRAY_SIZES = [2, 3, 4, 8, 16, 32, 64]
+
+
+def _builtin(name: str, *type_constructors: str) -> TypeRef:
+    return TypeRef([name], 'BUILTIN', TypeCat.BUILTIN, type_constructors)
+
+
+def _core_object() -> ClassDef:
+    class_def = ClassDef(['Object'], 'Core', TypeCat.CLASS)
+    for name, fields in (('Vector', 'XYZ'), ('Rotator', ['Pitch', 'Yaw', 'Roll']), ('Color', 'BGRA')):
+        class_def.structs.append(StructDef(['Object', name], 'Core', TypeCat.STRUCT,
+                                           properties=[PropertyRef(field, _builtin('float')) for field in fields]))
+    class_def.enums.append(EnumDef(['Object', 'EAxis'], 'Core', TypeCat.ENUM,
+                                   attributes={'AXIS_NONE': 0, 'AXIS_X': 1, 'AXIS_Y': 2, 'AXIS_Z': 4}))
+    return class_def
+
+
+class CorpusGenerator:
+    '''
+    Builds a synthetic dump for a game. Both games are built from the same seed so most of their classes match and
+    end up in common, the game specific rng adds the kind of differences the real games have: missing classes, extra
+    fields, extra enum values, extra params and a changed super.
+    '''
+
+    def __init__(self, game: Game, classes: int, seed: int = 0):
+        self.game = game
+        self.classes = classes
+        self.seed = seed
+        self._class_refs: list[TypeRef] = [TypeRef(['Object'], 'Core', TypeCat.CLASS)]
+        self._struct_refs: list[TypeRef] = []
+        self._enum_refs: list[TypeRef] = []
+
+    def generate(self) -> list[ClassDef]:
+        core_object = _core_object()
+        self._struct_refs = [TypeRef(struct.names, struct.package, struct.type_cat) for struct in core_object.structs]
+        self._enum_refs = [TypeRef(enum.names, enum.package, enum.type_cat) for enum in core_object.enums]
+        class_defs = [core_object]
+        named_packages: set[str] = set()
+
+        for i in range(1, self.classes):
+            rng = random.Random(f'{self.seed}:{i}')  # Shape shared by both games
+            game_rng = random.Random(f'{self.seed}:{self.game.value}:{i}')
+            package = PACKAGES[min(int(rng.paretovariate(1.2)) - 1, len(PACKAGES) - 1)] if i > 20 else 'Core'
+            # Some packages have a class with the same name, like Engine.Engine
+            name = package if package not in named_packages and package != 'Core' else f'{package[:4]}Class{i}'
+            named_packages.add(package)
+            class_def = ClassDef([name], package, TypeCat.CLASS)
+            # Mostly subclass something recent so hierarchies get deep
+            class_def.supers = [self._class_refs[max(0, len(self._class_refs) - 1 - int(rng.expovariate(0.05)))]]
+            if game_rng.random() < 0.002:
+                class_def.supers = [self._class_refs[0]]
+            self._class_refs.append(TypeRef(class_def.names, package, TypeCat.CLASS))
+
+            for e in range(rng.choice([0, 0, 0, 1, 1, 2])):
+                class_def.enums.append(self._enum_def(rng, game_rng, class_def, e))
+            for s in range(rng.choice([0, 0, 1, 1, 2, 4])):
+                class_def.structs.append(self._struct_def(rng, game_rng, class_def, s))
+            for p in range(int(rng.expovariate(1 / 8))):
+                class_def.properties.append(PropertyRef(f'Prop{p}', self._type_ref(rng, class_def)))
+            if game_rng.random() < 0.1:
+                class_def.properties.append(PropertyRef(f'{self.game.name}Only', _builtin('bool')))
+            for f in range(int(rng.expovariate(1 / 10))):
+                class_def.functions.append(self._function_def(rng, game_rng, class_def, f))
+
+            if self.game == Game.TPS and game_rng.random() < 0.05:
+                continue  # Class only exists in BL2
+            class_defs.append(class_def)
+        return class_defs
+
+    def _enum_def(self, rng: random.Random, game_rng: random.Random, class_def: ClassDef, idx: int) -> EnumDef:
+        name = f'E{class_def.name()}{idx}'
+        attributes = {f'{name[1:5].upper()}_{v}': v for v in range(rng.randint(2, 24))}
+        if game_rng.random() < 0.1:
+            attributes[f'{name[1:5].upper()}_{self.game.name}'] = len(attributes)
+        enum_def = EnumDef([class_def.name(), name], class_def.package, TypeCat.ENUM, attributes=attributes)
+        self._enum_refs.append(TypeRef(enum_def.names, enum_def.package, enum_def.type_cat))
+        return enum_def
+
+    def _struct_def(self, rng: random.Random, game_rng: random.Random, class_def: ClassDef, idx: int) -> StructDef:
+        struct_def = StructDef([class_def.name(), f'{class_def.name()}Struct{idx}'], class_def.package, TypeCat.STRUCT)
+        if rng.random() < 0.3:
+            # Extends a recent struct, which itself may extend another one
+            struct_def.supers = [self._struct_refs[max(0, len(self._struct_refs) - 1 - int(rng.expovariate(0.2)))]]
+        for p in range(rng.randint(0, 10)):
+            if rng.random() < 0.3:
+                type_ref = rng.choice(self._struct_refs[-50:])  # Nested struct
+            else:
+                type_ref = self._type_ref(rng, class_def)
+            struct_def.properties.append(PropertyRef(f'Field{p}', type_ref))
+        if game_rng.random() < 0.1:
+            struct_def.properties.append(PropertyRef(f'{self.game.name}Field', _builtin('int')))
+        self._struct_refs.append(TypeRef(struct_def.names, struct_def.package, struct_def.type_cat))
+        return struct_def
+
+    def _function_def(self, rng: random.Random, game_rng: random.Random, class_def: ClassDef, idx: int) -> FunctionDef:
+        # Delegates are functions in the real dumps too, properties reference them by signature
+        name = f'__OnEvent{idx}__Delegate' if rng.random() < 0.1 else f'Func{idx}'
+        func_def = FunctionDef([class_def.name(), name], class_def.package, TypeCat.FUNCTION)
+        optional = False  # Optional params are always last, like in UnrealScript
+        for p in range(int(rng.expovariate(1 / 3))):
+            type_ref = self._type_ref(rng, class_def)
+            if rng.random() < 0.15:
+                type_ref = type_ref.with_constructors('Out')
+            optional = optional or rng.random() < 0.2
+            if optional:
+                type_ref = type_ref.with_constructors('Optional')
+            func_def.params.append(ParamRef(f'Param{p}', type_ref))
+        if game_rng.random() < 0.02:
+            func_def.params.append(ParamRef(f'{self.game.name}Param', _builtin('int', 'Optional')))
+        func_def.ret = ReturnRef(self._type_ref(rng, class_def) if rng.random() < 0.4 else _builtin('None'))
+        return func_def
+
+    def _type_ref(self, rng: random.Random, class_def: ClassDef) -> TypeRef:
+        roll = rng.random()
+        if roll < 0.4:
+            type_ref = _builtin(rng.choice(BUILTIN_TYPES))
+        elif roll < 0.45:
+            type_ref = TypeRef(['str'], 'BUILTIN', TypeCat.CONST)
+        elif roll < 0.5:
+            type_ref = _builtin(rng.choice(['int', 'float']), 'AttributeProperty')
+        elif roll < 0.7:
+            type_ref = rng.choice(self._class_refs)
+        elif roll < 0.85:
+            type_ref = rng.choice(self._struct_refs)
+        elif roll < 0.95:
+            type_ref = rng.choice(self._enum_refs)
+        else:
+            type_ref = TypeRef([class_def.name(), '__OnEvent0__Delegate'], class_def.package, TypeCat.FUNCTION)
+
+        roll = rng.random()
+        if roll < 0.15:
+            type_ref = type_ref.with_constructors('list')
+        elif roll < 0.2:
+            type_ref = type_ref.with_constructors(f'tuple_{rng.choice(FIXED_ARRAY_SIZES)}')
+        elif roll < 0.22 and type_ref.type_cat == TypeCat.CLASS:
+            type_ref = type_ref.with_constructors('type')
+        return type_ref
+
+
+def generate_corpus(classes: int, seed: int = 0) -> tuple[list[ClassDef], list[ClassDef]]:
+    """BL2 and TPS class defs, about classes each."""
+    return CorpusGenerator(Game.BL2, classes, seed).generate(), CorpusGenerator(Game.TPS, classes, seed).generate()
+
+
+def measure(func: Callable[[], Any], repeat: int) -> tuple[Any, dict]:
+    """Best and mean time of func over repeat runs, then one traced run for the memory high-water mark above what was
+    allocated before it. Returns the last result and the stats."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    result = func()
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return result, {'seconds': round(min(times), 4), 'mean_seconds': round(sum(times) / len(times), 4),
+                    'peak_bytes': peak}
+
+
+def stub_files(stub_dir: str) -> list[str]:
+    return [os.path.join(root, name) for root, _, names in os.walk(stub_dir) for name in names if name.endswith('.pyi')]
+
+
+def parse_stubs(paths: list[str]) -> int:
+    """Parse every stub, returns the number of AST nodes."""
+    nodes = 0
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            nodes += sum(1 for _ in ast.walk(ast.parse(f.read(), path)))
+    return nodes
+
+
+def run_benchmark(classes: int, seed: int = 0, repeat: int = 3, workers: int = 1, compact: bool = False) -> dict:
+    from .write_stubs import write_all_stubs  # Needs paths.py, only import it when benchmarking
+
+    stages: dict[str, dict] = {}
+    with tempfile.TemporaryDirectory(prefix='bps_bench_') as tmp_dir:
+        (bl2, tps), stages['generate'] = measure(lambda: generate_corpus(classes, seed), repeat)
+
+        def ir_write():
+            write_ir(f'{tmp_dir}/BL2_class_defs.ir', bl2)
+            write_ir(f'{tmp_dir}/TPS_class_defs.ir', tps)
+
+        _, stages['ir_write'] = measure(ir_write, repeat)
+        _, stages['ir_read'] = measure(lambda: (read_ir(f'{tmp_dir}/BL2_class_defs.ir'),
+                                                read_ir(f'{tmp_dir}/TPS_class_defs.ir')), repeat)
+        common, stages['merge'] = measure(lambda: create_common_class_defs(bl2, tps), repeat)
+        # Resolving namespaces is building the resolver since set_game was replaced by render contexts
+        common_names, stages['resolve'] = measure(lambda: NameResolver.from_class_defs(common), repeat)
+
+        namespaces = {f'{tmp_dir}/stubs/{game.value}': (Context(game, common_names, compact=compact), class_defs)
+                      for game, class_defs in ((Game.COMMON, common), (Game.TPS, tps), (Game.BL2, bl2))}
+
+        def render():
+            TYPE_STR_CACHE.clear()  # Measure a cold run, like write_stubs does
+            return sum(len(class_def.to_str(ctx)) for ctx, class_defs in namespaces.values()
+                       for class_def in class_defs)
+
+        rendered_chars, stages['render'] = measure(render, repeat)
+
+        def write_stubs():
+            TYPE_STR_CACHE.clear()
+            return write_all_stubs(namespaces, workers)
+
+        _, stages['write_stubs'] = measure(write_stubs, repeat)
+
+        paths = stub_files(f'{tmp_dir}/stubs')
+        stub_bytes = sum(os.path.getsize(path) for path in paths)
+        ast_nodes, stages['ast_parse'] = measure(lambda: parse_stubs(paths), repeat)
+
+    return {
+        'classes': classes,
+        'seed': seed,
+        'repeat': repeat,
+        'workers': workers,
+        'compact': compact,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'counts': {
+            'bl2_classes': len(bl2),
+            'tps_classes': len(tps),
+            'common_classes': len(common),
+            'common_names': len(common_names),
+            'functions': sum(len(class_def.functions) for _, class_defs in namespaces.values()
+                             for class_def in class_defs),
+            'rendered_chars': rendered_chars,
+            'stub_files': len(paths),
+            'stub_bytes': stub_bytes,
+            'ast_nodes': ast_nodes,
+        },
+        'stages': stages,
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+    }
+
+
+def compare(result: dict, baseline: dict, threshold: float) -> list[str]:
+    """Stages that got slower than threshold times the baseline."""
+    regressions = []
+    for stage, stats in result['stages'].items():
+        base_stats = baseline['stages'].get(stage)
+        if not base_stats:
+            continue
+        ratio = stats['seconds'] / base_stats['seconds'] if base_stats['seconds'] else 1.0
+        mem_ratio = stats['peak_bytes'] / base_stats['peak_bytes'] if base_stats['peak_bytes'] else 1.0
+        print(f'{stage:<12} {base_stats["seconds"]:>8.3f}s -> {stats["seconds"]:>8.3f}s ({ratio:.2f}x), '
+              f'peak {mem_ratio:.2f}x', file=sys.stderr)
+        if ratio > threshold:
+            regressions.append(stage)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages on a synthetic corpus.')
+    parser.add_argument('-n', '--classes', type=int, default=2000, help='Classes per game.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Timed runs per stage, the best one is reported.')
+    parser.add_argument('-j', '--workers', type=int, default=1, help='Render processes for the write_stubs stage.')
+    parser.add_argument('--compact', action='store_true', help='Render functions in compact mode.')
+    parser.add_argument('-o', '--out', help='Write the JSON result here instead of stdout.')
+    parser.add_argument('-c', '--compare', help='Previous JSON result to compare against.')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='With --compare, exit with an error if a stage is this many times slower.')
+    args = parser.parse_args()
+
+    result = run_benchmark(args.classes, args.seed, args.repeat, args.workers or os.cpu_count() or 1, args.compact)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+    else:
+        print(json.dumps(result, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.threshold)
+        if regressions:
+            sys.exit(f'Slower than {args.threshold}x baseline: {", ".join(regressions)}')
+
+register_module(__name__)
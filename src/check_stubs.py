@@ -0,0 +1,276 @@
+'''Checks that a written stub tree imports the way Python and type checkers would import it.
+
+Every module is loaded by following its import statements like the import system does: a submodule is bound on its
+package once it has loaded, and `from .x import y` binds y over whatever had that name before. Imported names are
+looked up when they're used, like a type checker reading stubs, so import cycles and self imports are fine. Then every
+qualified reference in the stubs (bl2_Core_Object.Vector, ...) is resolved through the loaded modules and classes, and
+a missing module, an import of a name that isn't there or a root export that shadows a package is reported with its
+file and line. Nothing is executed, so unrealsdk isn't needed.
+
+    python -m src.check_stubs                   check PYSTUBS_DIR
+    python -m src.check_stubs path/to/stubs
+'''
+from __future__ import annotations
+
+import argparse
+import ast
+import gc
+import os
+import re
+from dataclasses import dataclass, field
+
+from .paths import PYSTUBS_DIR
+from .runner import register_module
+
+STUB_SUFFIXES = ('.pyi', '.py')
+
+# Value of a name the check doesn't follow: modules outside the tree, functions, variables and type aliases
+OPAQUE = object()
+
+DOTTED_NAME = re.compile(r'(?<![\w.])[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)+')
+
+
+@dataclass
+class StubModule:
+    name: str
+    path: str
+    is_package: bool
+    source: str = field(default='', repr=False)
+    names: dict[str, object] = field(default_factory=dict, repr=False)
+    submodules: dict[str, StubModule] = field(default_factory=dict, repr=False)
+
+
+@dataclass
+class StubClass:
+    qualname: str
+    node: ast.ClassDef
+    module: StubModule = field(repr=False)  # Where the bases are looked up
+
+    def attr(self, name: str) -> object | None:
+        """Nested class or member, looked up through the bases too since delta stubs leave inherited members out."""
+        for stmt in self.node.body:
+            if isinstance(stmt, ast.ClassDef) and stmt.name == name:
+                return StubClass(f'{self.qualname}.{name}', stmt, self.module)
+            if name in _bound_names(stmt):
+                return OPAQUE
+        for base in self.node.bases:
+            base_value = resolve(self.module, ast.unparse(base).split('.'))
+            if isinstance(base_value, StubClass):
+                value = base_value.attr(name)
+                if value is not None:
+                    return value
+        return None
+
+
+@dataclass
+class ImportedName:
+    """A from import. Looked up when it's used rather than when the import runs, like type checkers do, since stubs
+    can import from modules that haven't finished loading, their own included."""
+    source: StubModule = field(repr=False)
+    name: str
+    line: int
+
+    def value(self) -> object | None:
+        value: object | None = self
+        seen = set()
+        while isinstance(value, ImportedName):
+            if id(value) in seen:  # Import cycle with nothing at the end of it
+                return None
+            seen.add(id(value))
+            value = value.source.names.get(value.name)
+        return value
+
+
+def _deref(value: object | None) -> object | None:
+    return value.value() if isinstance(value, ImportedName) else value
+
+
+def resolve(module: StubModule, chain: list[str]) -> object | None:
+    """Value of a dotted name in module, None if some part of it is missing."""
+    value = _deref(module.names.get(chain[0]))
+    for name in chain[1:]:
+        if isinstance(value, StubModule):
+            value = _deref(value.names.get(name))
+        elif isinstance(value, StubClass):
+            value = _deref(value.attr(name))
+        else:
+            return value
+    return value
+
+
+def _bound_names(stmt: ast.stmt) -> list[str]:
+    """Names a statement other than a class or an import binds."""
+    if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.TypeAlias)):
+        return [stmt.name.id if isinstance(stmt.name, ast.Name) else stmt.name]
+    if isinstance(stmt, ast.AnnAssign) and isinstance(stmt.target, ast.Name):
+        return [stmt.target.id]
+    if isinstance(stmt, ast.Assign):
+        return [target.id for target in stmt.targets if isinstance(target, ast.Name)]
+    return []
+
+
+class StubTree:
+    """The modules under root, loaded on demand like sys.modules. Problems found along the way go in errors."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.modules: dict[str, StubModule] = {}
+        self.errors: list[str] = []
+
+    def find(self, name: str) -> tuple[str, bool] | None:
+        """Path of a module and if it's a package, None if it isn't in the tree."""
+        base = os.path.join(self.root, *name.split('.'))
+        for suffix in STUB_SUFFIXES:
+            if os.path.isfile(f'{base}/__init__{suffix}'):
+                return f'{base}/__init__{suffix}', True
+        for suffix in STUB_SUFFIXES:
+            if os.path.isfile(f'{base}{suffix}'):
+                return f'{base}{suffix}', False
+        return None
+
+    def import_module(self, name: str) -> StubModule | None:
+        """None for modules outside the tree."""
+        if name in self.modules:
+            return self.modules[name]
+        parent_name, _, child = name.rpartition('.')
+        parent = self.import_module(parent_name) if parent_name else None
+        if parent_name and parent is None:
+            return None
+        if name in self.modules:  # The parent's __init__ imported it
+            return self.modules[name]
+        found = self.find(name)
+        if found is None:
+            return None
+        module = self.modules[name] = StubModule(name, *found)
+        self._exec(module)
+        if parent:
+            parent.names[child] = module  # Bound after the submodule ran, like the import system does
+            parent.submodules[child] = module
+        return module
+
+    def _exec(self, module: StubModule) -> None:
+        with open(module.path) as f:
+            module.source = f.read()
+        try:
+            tree = ast.parse(module.source, module.path)
+        except SyntaxError as e:
+            self.errors.append(f'{module.path}:{e.lineno}: {e.msg}')
+            return
+        for stmt in tree.body:
+            if isinstance(stmt, ast.Import):
+                for alias in stmt.names:
+                    imported = self.import_module(alias.name)
+                    if imported is None:
+                        self._check_found(module, alias.name, stmt.lineno)
+                    if alias.asname:
+                        module.names[alias.asname] = imported or OPAQUE
+                    else:
+                        top = alias.name.split('.')[0]
+                        module.names[top] = self.modules.get(top, OPAQUE)
+            elif isinstance(stmt, ast.ImportFrom):
+                self._exec_import_from(module, stmt)
+            elif isinstance(stmt, ast.ClassDef):
+                module.names[stmt.name] = StubClass(f'{module.name}.{stmt.name}', stmt, module)
+            else:
+                for name in _bound_names(stmt):
+                    module.names[name] = OPAQUE
+
+    def _check_found(self, module: StubModule, name: str, line: int) -> None:
+        """Modules outside the tree are fine, a missing one in a package of the tree isn't."""
+        if self.find(name.split('.')[0]):
+            self.errors.append(f'{module.path}:{line}: no module {name}')
+
+    def _exec_import_from(self, module: StubModule, stmt: ast.ImportFrom) -> None:
+        target = stmt.module or ''
+        if stmt.level:
+            package = module.name.split('.')
+            if not module.is_package:
+                package.pop()
+            package = package[:len(package) - stmt.level + 1]
+            target = '.'.join(package + ([stmt.module] if stmt.module else []))
+        source = self.import_module(target)
+        if source is None:
+            self._check_found(module, target, stmt.lineno)
+        for alias in stmt.names:
+            if source and alias.name not in source.names:
+                self.import_module(f'{target}.{alias.name}')  # Binds the submodule on source if there is one
+            module.names[alias.asname or alias.name] = ImportedName(source, alias.name, stmt.lineno) if source \
+                else OPAQUE
+
+    def check_refs(self, module: StubModule) -> None:
+        '''
+        Resolve every qualified reference in module that starts at a module in the tree. References are found in the
+        source rather than the AST, the same few types are referenced all over a file so each is resolved once. That
+        includes the ones in docstrings, which are written the same way as the annotations.
+        '''
+        # Class files are replaced by their class on purpose, packages have to stay reachable
+        for name, submodule in module.submodules.items():
+            if submodule.is_package and _deref(module.names.get(name)) is not submodule:
+                self.errors.append(f'{module.path}: {name} is bound over the {submodule.name} package')
+        for value in module.names.values():
+            if isinstance(value, ImportedName) and value.value() is None:
+                self.errors.append(f'{module.path}:{value.line}: cannot import {value.name} from {value.source.name}')
+
+        refs: dict[str, int] = {}
+        for match in DOTTED_NAME.finditer(module.source):
+            refs.setdefault(match.group(), match.start())
+        for ref, pos in refs.items():
+            chain = ref.split('.')
+            start = module.names.get(chain[0])
+            if not isinstance(start, (ImportedName, StubModule)) or \
+                    not isinstance(_deref(start), (StubModule, StubClass)):
+                continue
+            if resolve(module, chain) is None:
+                # Find the first part that's missing for the message
+                i = next(i for i in range(2, len(chain) + 1) if resolve(module, chain[:i]) is None)
+                line = module.source.count('\n', 0, pos) + 1
+                self.errors.append(f'{module.path}:{line}: {ref}, {".".join(chain[:i - 1])} has no attribute '
+                                   f'{chain[i - 1]}')
+
+
+def check_stub_tree(root: str = PYSTUBS_DIR, namespaces: list[str] | None = None) -> list[str]:
+    '''
+    Load every stub under the namespace packages of root (every package in it by default) and resolve their qualified
+    references. Returns the problems found, empty when the tree is fine. Namespace roots are imported first, so
+    their exports are bound the same way they would be in an IDE.
+    '''
+    tree = StubTree(root)
+    if namespaces is None:
+        namespaces = sorted(name for name in os.listdir(root) if tree.find(name) and tree.find(name)[1])
+    # Every stub's AST stays alive until the end, so collections while loading them are all cost and no gain
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        module_names = []
+        for namespace in namespaces:
+            tree.import_module(namespace)
+            for dir_path, _, file_names in os.walk(os.path.join(root, namespace)):
+                package = os.path.relpath(dir_path, root).replace(os.sep, '.')
+                for file_name in sorted(file_names):
+                    stem, suffix = os.path.splitext(file_name)
+                    if suffix in STUB_SUFFIXES:
+                        module_names.append(package if stem == '__init__' else f'{package}.{stem}')
+        for name in module_names:
+            module = tree.import_module(name)
+            if module:
+                tree.check_refs(module)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return tree.errors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that the references in a written stub tree resolve.')
+    parser.add_argument('root', nargs='?', default=PYSTUBS_DIR, help='Stub dir with the namespace packages in it.')
+    parser.add_argument('-n', '--namespace', action='append', help='Only check this namespace, can be repeated.')
+    args = parser.parse_args()
+
+    errors = check_stub_tree(args.root, args.namespace)
+    for error in errors:
+        print(error)
+    print(f'{len(errors)} problems')
+    if errors:
+        raise SystemExit(1)
+
+register_module(__name__)
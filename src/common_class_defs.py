@@ -1,120 +1,209 @@
-import pickle
+import argparse
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from itertools import combinations
 
 from .definitions import ClassDef, EnumDef, StructDef
 from .game import Game
+from .ir_file import IRReader, IRWriter, read_ir, shard_path, write_ir
 from .paths import CLASS_DEF_DATA_DIR
 
 
-def get_common_elements(bl2_list: list, tps_list: list) -> list:
+def get_common_elements(*element_lists: list) -> list:
+    """Elements of the first list that also appear in every other list, in first list order without duplicates.
+    Elements are matched on key() so this stays linear instead of comparing dataclasses pairwise."""
+    other_keys = [{element.key() for element in element_list} for element_list in element_lists[1:]]
+    seen = set()
     ret_list = []
-    for element in bl2_list + tps_list:
-        if element in bl2_list and element in tps_list and element not in ret_list:
+    for element in element_lists[0]:
+        key = element.key()
+        if key not in seen and all(key in keys for keys in other_keys):
+            seen.add(key)
             ret_list.append(element)
     return ret_list
 
 
-def create_common_struct_def(tps_struct: StructDef, bl2_struct: StructDef) -> StructDef:
-    assert tps_struct.full_name() == bl2_struct.full_name() and tps_struct.supers == bl2_struct.supers
+def create_common_struct_def(*structs: StructDef) -> StructDef:
+    """Structs in game order. Fields keep the order of the last game."""
+    first = structs[0]
+    assert all(struct.full_name() == first.full_name() and struct.supers == first.supers for struct in structs)
 
-    common_struct = bl2_struct
-    common_struct.properties = get_common_elements(tps_struct.properties, bl2_struct.properties)
-    return common_struct
+    # New def rather than a game's struct so the game versions keep their game only fields
+    return StructDef(first.names, first.package, first.type_cat, supers=list(first.supers),
+                     properties=get_common_elements(*(struct.properties for struct in reversed(structs))))
 
 
-def create_common_enum_def(tps_enum: EnumDef, bl2_enum: EnumDef) -> EnumDef:
-    assert tps_enum.full_name() == bl2_enum.full_name()
+def create_common_enum_def(*enums: EnumDef) -> EnumDef:
+    """Enums in game order. Values keep the order of the last game, only values that are the same in all are kept."""
+    last = enums[-1]
+    assert all(enum.full_name() == last.full_name() for enum in enums)
 
-    common_enum_def = EnumDef(names=tps_enum.names, package=tps_enum.package, type_cat=tps_enum.type_cat)
-    for name, value in tps_enum.attributes.items():
-        if bl2_enum.attributes.get(name) == value:
+    common_enum_def = EnumDef(names=last.names, package=last.package, type_cat=last.type_cat)
+    for name, value in last.attributes.items():
+        if all(enum.attributes.get(name) == value for enum in enums[:-1]):
             common_enum_def.attributes[name] = value
     return common_enum_def
 
 
-def create_common_class_def(tps_cls: ClassDef, bl2_cls: ClassDef) -> ClassDef | None:
-    assert tps_cls.names == bl2_cls.names and tps_cls.package == bl2_cls.package and tps_cls.type_cat == bl2_cls.type_cat
-    common_class_def = ClassDef(bl2_cls.names, bl2_cls.package, bl2_cls.type_cat, bl2_cls.supers, game=Game.COMMON)
+def create_common_class_def(*classes: ClassDef) -> ClassDef:
+    """Classes in game order, the first game's supers and member order are used."""
+    first = classes[0]
+    assert all(cls.names == first.names and cls.package == first.package and cls.type_cat == first.type_cat
+               for cls in classes)
+    common_class_def = ClassDef(first.names, first.package, first.type_cat, list(first.supers))
 
     # Properties
-    common_class_def.properties = get_common_elements(bl2_cls.properties, tps_cls.properties)
+    common_class_def.properties = get_common_elements(*(cls.properties for cls in classes))
 
     # Functions
-    common_class_def.functions = get_common_elements(bl2_cls.functions, tps_cls.functions)
+    common_class_def.functions = get_common_elements(*(cls.functions for cls in classes))
 
     # Structs - Now we have to do a little prep since we want a base struct def that only includes common fields
-    tps_structs: dict[str, StructDef] = {struct.name(): struct for struct in tps_cls.structs}
-    bl2_structs: dict[str, StructDef] = {struct.name(): struct for struct in bl2_cls.structs}
-    for struct_name in list(set(tps_structs.keys()) & set(bl2_structs.keys())):
-        tps_struct = tps_structs.get(struct_name)
-        bl2_struct = bl2_structs.get(struct_name)
-        if tps_struct and bl2_struct and tps_struct.supers == bl2_struct.supers:
-            common_class_def.structs.append(create_common_struct_def(tps_struct, bl2_struct))
+    game_structs: list[dict[str, StructDef]] = [{struct.name(): struct for struct in cls.structs} for cls in classes]
+    for struct_name in game_structs[0]:
+        structs = [structs.get(struct_name) for structs in game_structs]
+        if all(structs) and all(struct.supers == structs[0].supers for struct in structs):
+            common_class_def.structs.append(create_common_struct_def(*structs))
 
     # Enums - Have to find common attributes
-    tps_enums: dict[str, EnumDef] = {enum.name(): enum for enum in tps_cls.enums}
-    bl2_enums: dict[str, EnumDef] = {enum.name(): enum for enum in bl2_cls.enums}
-    for enum_name in list(set(tps_enums.keys()) & set(bl2_enums.keys())):
-        tps_enum = tps_enums.get(enum_name)
-        bl2_enum = bl2_enums.get(enum_name)
-        if tps_enum and bl2_enum:
-            common_class_def.enums.append(create_common_enum_def(tps_enum, bl2_enum))
-
-    # Don't need common full names arg because when it doesn't find in list it'll revert to first arg anyway.
-    common_class_def.set_game(Game.COMMON, [])
+    game_enums: list[dict[str, EnumDef]] = [{enum.name(): enum for enum in cls.enums} for cls in classes]
+    for enum_name in game_enums[0]:
+        enums = [enums.get(enum_name) for enums in game_enums]
+        if all(enums):
+            common_class_def.enums.append(create_common_enum_def(*enums))
+
     return common_class_def
 
 
 def get_game_elements(common_list: list, game_list: list) -> list:
-    return [element for element in game_list if element not in common_list]
+    common_keys = {element.key() for element in common_list}
+    return [element for element in game_list if element.key() not in common_keys]
+
+
+class GameIndex[K]:
+    '''
+    Class defs of any number of games by full name, built in one pass over all of them. Any combination of the games
+    can then be merged without going through the inputs again, instead of merging the games a pair at a time.
+    Class order is the order names first appear in, going through the games in order, so it's stable from run to run.
+    '''
+
+    def __init__(self, game_class_defs: dict[K, list[ClassDef]]):
+        self.games = list(game_class_defs)
+        self.by_name: dict[str, dict[K, ClassDef]] = {}
+        for game, class_defs in game_class_defs.items():
+            for cls in class_defs:
+                self.by_name.setdefault(cls.full_name(), {})[game] = cls
+
+    def common_class_defs(self, games: tuple[K, ...] | None = None) -> list[ClassDef]:
+        """Common versions of the classes in all of games, every game by default. Class defs aren't modified."""
+        games = games or tuple(self.games)
+        common_class_defs = []
+        for game_classes in self.by_name.values():
+            classes = [game_classes.get(game) for game in games]
+            # There's one class with a different super in BL2 and TPS, just going to keep that in game specific only
+            if all(classes) and all(cls.supers == classes[0].supers for cls in classes):
+                common_class_defs.append(create_common_class_def(*classes))
+        return common_class_defs
+
+    def lattice(self, min_games: int = 2) -> dict[tuple[K, ...], list[ClassDef]]:
+        """Common class defs of every combination of at least min_games games."""
+        return {games: self.common_class_defs(games)
+                for size in range(min_games, len(self.games) + 1) for games in combinations(self.games, size)}
+
+
+def create_common_class_defs(*game_class_defs: list[ClassDef]) -> list[ClassDef]:
+    """Common versions of the classes in every game, games in order (BL2, TPS, ...). No game's class defs are
+    modified."""
+    return GameIndex(dict(enumerate(game_class_defs))).common_class_defs()
+
+
+def game_ir_path(game: Game) -> str:
+    return f'{CLASS_DEF_DATA_DIR}/{game.name}_class_defs.ir'
+
+
+def merge_package(game_paths: dict[Game, str], package: str, shard_dir: str) -> int:
+    """Merge one package of every game into its own shard. Runs in the worker processes, only this package's classes
+    are loaded. Returns the number of common classes."""
+    game_class_defs = {}
+    for game, path in game_paths.items():
+        with IRReader(path) as reader:
+            game_class_defs[game] = reader.load_package(package)
+    class_defs = GameIndex(game_class_defs).common_class_defs()
+    write_ir(shard_path(shard_dir, package), class_defs)
+    return len(class_defs)
+
+
+def merge_sharded(game_paths: dict[Game, str], out_path: str, workers: int = 1,
+                  shard_dir: str = f'{CLASS_DEF_DATA_DIR}/common_shards') -> int:
+    '''
+    Same output as merging the whole games with GameIndex, one package at a time. Classes never cross packages, so
+    packages are merged on their own across a process pool, largest first, and each is written to a shard as soon
+    as it's done. Peak memory depends on the biggest package rather than the whole game.
+    The final pass goes over the common names of every shard and writes the classes to out_path in the order a full
+    merge has them, loading one class at a time. Returns the number of common classes.
+    '''
+    if os.path.exists(shard_dir):
+        shutil.rmtree(shard_dir)
+    os.makedirs(shard_dir)
+
+    # Only the IR indexes are read here, the class defs are left to the workers
+    names: list[str] = []
+    package_sizes: dict[str, int] = {}
+    for path in game_paths.values():
+        with IRReader(path) as reader:
+            names.extend(reader.class_names())
+            for package in reader.packages():
+                package_sizes[package] = package_sizes.get(package, 0) + len(reader.class_names(package))
+    packages = sorted(package_sizes, key=package_sizes.get, reverse=True)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(merge_package, [game_paths] * len(packages), packages, [shard_dir] * len(packages)))
+    else:
+        for package in packages:
+            merge_package(game_paths, package, shard_dir)
+
+    # Cross shard pass, names are kept in the order they first appear going through the games
+    with ExitStack() as stack:
+        shards = {package: stack.enter_context(IRReader(shard_path(shard_dir, package))) for package in packages}
+        common_names = {name: reader for reader in shards.values() for name in reader.class_names()}
+        with IRWriter(out_path) as writer:
+            for name in dict.fromkeys(names):
+                if name in common_names:
+                    writer.add(common_names[name].load_class(name))
+    shutil.rmtree(shard_dir)
+    return len(common_names)
 
 
 if __name__ == '__main__':
-    with open(f'{CLASS_DEF_DATA_DIR}/TPS_class_defs.pkl', 'rb') as f:
-        tps_class_defs: list[ClassDef] = pickle.load(f)
-
-    with open(f'{CLASS_DEF_DATA_DIR}/BL2_class_defs.pkl', 'rb') as f:
-        bl2_class_defs: list[ClassDef] = pickle.load(f)
-
-    bl2_base: dict[str, ClassDef] = {cls.full_name(): cls for cls in bl2_class_defs}
-    tps_base: dict[str, ClassDef] = {cls.full_name(): cls for cls in tps_class_defs}
-
-    common: dict[str, ClassDef] = {}
-    bl2: dict[str, ClassDef] = {}
-    tps: dict[str, ClassDef] = {}
-
-    # Get names list
-    all_names = list(set(list(tps_base.keys()) + list(bl2_base.keys())))
-
-    common_class_defs = []
-    for cls_name in all_names:
-        tps_cls = tps_base.get(cls_name)
-        bl2_cls = bl2_base.get(cls_name)
-        # There's one class with a different super, just going to keep that in game specific only
-        if tps_cls and bl2_cls and (tps_cls.supers == bl2_cls.supers):
-            common_class_def = create_common_class_def(tps_cls, bl2_cls)
-            common_class_defs.append(common_class_def)
-
-    common_names = list(set(name for ccd in common_class_defs for name in ccd.get_full_names()))
-
-    for cls in common_class_defs:
-        cls.set_game(Game.COMMON, common_names)
-
-    # Doing this here since setting game for game specific changes some mutable refs in common that I don't want to deal with right now.
-    with open(f'{CLASS_DEF_DATA_DIR}/common_class_defs_adj.pkl', 'wb') as f:
-        pickle.dump(common_class_defs, f)
-
-    for cls in tps_class_defs:
-        cls.set_game(Game.TPS, common_names)
-
-    with open(f'{CLASS_DEF_DATA_DIR}/tps_class_defs_adj.pkl', 'wb') as f:
-        pickle.dump(tps_class_defs, f)
-
-    for cls in bl2_class_defs:
-        cls.set_game(Game.BL2, common_names)
-
-    with open(f'{CLASS_DEF_DATA_DIR}/bl2_class_defs_adj.pkl', 'wb') as f:
-        pickle.dump(bl2_class_defs, f)
-
-
-
-
+    parser = argparse.ArgumentParser(description='Merge the game class def IR files into common_class_defs.ir.')
+    parser.add_argument('-l', '--lattice', action='store_true',
+                        help='Also write the common class defs of every smaller combination of games, '
+                             'like common_BL2_TPS_class_defs.ir.')
+    parser.add_argument('-s', '--sharded', action='store_true',
+                        help='Merge one package at a time to keep memory down, with -j processes.')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='With --sharded, number of merge processes. 0 uses every core.')
+    args = parser.parse_args()
+
+    games = [game for game in Game if game != Game.COMMON]
+    common_path = f'{CLASS_DEF_DATA_DIR}/common_class_defs.ir'
+    if args.sharded:
+        if args.lattice:
+            parser.error('--lattice needs the whole games loaded, it does not work with --sharded')
+        count = merge_sharded({game: game_ir_path(game) for game in games}, common_path,
+                              args.workers or os.cpu_count() or 1)
+        print(f'{common_path}: {count} common classes')
+        raise SystemExit
+
+    index = GameIndex({game: read_ir(game_ir_path(game)) for game in games})
+
+    # Namespaces are picked when writing stubs, so the game IR files are used as is and only common is written here.
+    write_ir(common_path, index.common_class_defs())
+    if args.lattice:
+        for combo, class_defs in index.lattice().items():
+            if len(combo) < len(games):
+                write_ir(f'{CLASS_DEF_DATA_DIR}/common_{"_".join(game.name for game in combo)}_class_defs.ir',
+                         class_defs)
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from dataclasses import dataclass, field
 from enum import Enum, auto
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Iterable
 from copy import copy
 
 from .game import Game
@@ -49,13 +49,7 @@ class TypeCat(Enum):
     OTHER = auto()
 
 
-@dataclass
-class Context:
-    game: Game
-    cls: str
-
-
-@dataclass
+@dataclass(slots=True)
 class BaseDef:
     names: list[str]  # From class on down. struct property would be [cls, struct, prop]
     package: str
@@ -74,9 +68,70 @@ class BaseDef:
         """Full name starting with package."""
         return f"{self.package}.{'.'.join(self.names)}"
 
+    def path(self) -> tuple[str, ...]:
+        """Same as full_name but as a tuple, cheaper to build for lookups."""
+        return (self.package, *self.names)
+
+    def module(self, game: Game) -> str:
+        """Stub file the object is in for a namespace, the file of its outermost class."""
+        return f'{game.value}.{self.package}.{self.names[0]}'
+
+    def import_name(self, game: Game) -> str:
+        """Name a file referencing the object imports its outermost class as."""
+        return f'{game.value}_{self.package}_{self.names[0]}'
+
+    def import_str(self, game: Game) -> str:
+        # Straight from the class's file. Going through the package (bl2.Core.Object) is ambiguous between the
+        # class the package exports and the submodule of the same name, and mypy picks the submodule in import cycles
+        return f'from {self.module(game)} import {self.names[0]} as {self.import_name(game)}\n'
+
+    def ref_str(self, game: Game) -> str:
+        """Reference to the object in a namespace, through the import of its outermost class."""
+        return '.'.join((self.import_name(game), *self.names[1:]))
 
     @classmethod
     def from_uobject[T: BaseDef](cls: type[T], obj: UObject) -> T:
+        names, package, type_cat = OUTER_CHAIN_CACHE.resolve(obj)
+        return cls(
+            names=list(names),
+            package=package,
+            type_cat=type_cat,
+        )
+
+
+UOBJECT_TYPE_MAP = {
+    'Class': TypeCat.CLASS,
+    'ScriptStruct': TypeCat.STRUCT,
+    'Enum': TypeCat.ENUM,
+    'Function': TypeCat.FUNCTION,
+}
+
+
+class OuterChainCache:
+    '''
+    Per-run cache of the names, package and type category resolved from a UObject's Outer chain, keyed on the object's
+    address. The same structs and classes get referenced by huge numbers of properties during extraction, so this
+    saves walking the chain every time. Clear it at the start of each run.
+    '''
+
+    def __init__(self):
+        self._entries: dict[int, tuple[tuple[str, ...], str, TypeCat]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, obj: UObject) -> tuple[tuple[str, ...], str, TypeCat]:
+        key = obj._get_address()
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+
         names = [obj.Name]
         outer = obj.Outer
         package = None
@@ -84,76 +139,241 @@ class BaseDef:
             if outer.Class.Name == 'Package':
                 package = outer.Name
             else:
-                names = [outer.Name] + names
+                names.insert(0, outer.Name)
             outer = outer.Outer
         if not package:
             raise ValueError(f"Couldn't find package for {obj._path_name()}")
 
-        type_map = {
-            'Class': TypeCat.CLASS,
-            'ScriptStruct': TypeCat.STRUCT,
-            'Enum': TypeCat.ENUM,
-            'Function': TypeCat.FUNCTION,
-        }
+        entry = self._entries[key] = (tuple(names), package, UOBJECT_TYPE_MAP.get(obj.Class.Name, TypeCat.OTHER))
+        return entry
 
-        type_cat = type_map.get(obj.Class.Name, TypeCat.OTHER)
+    def stats_str(self) -> str:
+        total = self.hits + self.misses
+        return f'Outer chain cache: {self.hits} hits, {self.misses} misses ({self.hits / total if total else 0:.1%} hit rate)'
 
-        return cls(
-            names=names,
-            package=package,
-            type_cat=type_cat,
-        )
+
+OUTER_CHAIN_CACHE = OuterChainCache()
+
+
+class TypeRole(Enum):
+    GETTER = auto()
+    SETTER = auto()
+    PARAM = auto()
+    RETURN = auto()
+
+
+class TypeStrCache:
+    '''
+    Bounded cache of rendered type annotations, keyed on type ref, namespace and role. There are only a few thousand
+    distinct annotations but they get rendered hundreds of thousands of times. TypeRefs are interned and immutable, so
+    entries never go stale. Oldest entries are dropped once max_size is reached.
+    '''
+
+    def __init__(self, max_size: int = 65536):
+        self.max_size = max_size
+        self._entries: dict[tuple[TypeRef, Game, TypeRole], str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, type_ref: TypeRef, game: Game, role: TypeRole) -> str:
+        key = (type_ref, game, role)
+        type_str = self._entries.get(key)
+        if type_str is not None:
+            self.hits += 1
+            return type_str
+        self.misses += 1
+
+        if role == TypeRole.PARAM:
+            type_str = ParamRef.render_type(type_ref, game)
+        elif role == TypeRole.RETURN:
+            type_str = ReturnRef.render_type(type_ref, game)
+        else:
+            type_str = PropertyRef.render_type(type_ref, game, role == TypeRole.SETTER)
+
+        if len(self._entries) >= self.max_size:
+            del self._entries[next(iter(self._entries))]
+        self._entries[key] = type_str
+        return type_str
+
+    def stats_str(self) -> str:
+        total = self.hits + self.misses
+        return f'Type string cache: {self.hits} hits, {self.misses} misses ({self.hits / total if total else 0:.1%} hit rate)'
+
+
+TYPE_STR_CACHE = TypeStrCache()
+
+
+class NameResolver:
+    '''
+    Frozen index of the full names that exist in common. Built once from the common IR and shared by
+    the common, BL2 and TPS render contexts to decide which namespace a reference resolves to.
+    '''
+
+    def __init__(self, full_names: Iterable[str] = ()):
+        self._paths: frozenset[tuple[str, ...]] = frozenset(tuple(name.split('.')) for name in full_names)
+
+    @classmethod
+    def from_class_defs(cls, class_defs: Iterable[ClassDef]) -> NameResolver:
+        return cls(name for class_def in class_defs for name in class_def.get_full_names())
+
+    def __contains__(self, obj: BaseDef) -> bool:
+        return obj.path() in self._paths
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def resolve(self, obj: BaseDef, try_game: Game) -> Game:
+        """Common if the object exists there, otherwise the game we're trying for."""
+        return Game.COMMON if obj.path() in self._paths else try_game
+
+
+@dataclass(frozen=True)
+class Context:
+    '''
+    The namespace being rendered and how refs resolve in it. Rendering reads defs through a context instead of
+    storing the namespace on every ref, so one unmodified IR can be rendered as common, BL2 and TPS.
+    With common_defs (full name -> common ClassDef) set, game namespaces are rendered as inheritance deltas: members
+    that render the same as the common version they inherit from are left out.
+    With compact set, functions are rendered with FunctionDef.to_compact_str.
+    '''
+    game: Game
+    resolver: NameResolver
+    common_defs: dict[str, ClassDef] | None = field(default=None, compare=False)
+    compact: bool = False
+
+    def resolve(self, type_ref: TypeRef) -> Game:
+        """Namespace for setters, params and struct fields, common when the type exists there."""
+        return self.resolver.resolve(type_ref, self.game)
+
+    def supers(self, obj: BaseDef, supers: list[TypeRef]) -> list[tuple[TypeRef, Game]]:
+        """Supers with the namespace each renders in. A super with the same name is the common version of obj. In game
+        namespaces the common version is added as the first super when it exists."""
+        resolved = [(sup, Game.COMMON if sup.name() == obj.name() else self.game) for sup in supers]
+        if self.game != Game.COMMON and obj.name() not in [sup.name() for sup in supers] and obj in self.resolver:
+            resolved.insert(0, (TypeRef(obj.names, obj.package, obj.type_cat), Game.COMMON))
+        return resolved
+
+    def supers_str(self, obj: BaseDef, supers: list[TypeRef]) -> list[str]:
+        return [sup.to_str(game) for sup, game in self.supers(obj, supers)]
+
+    def delta_base(self, obj: BaseDef, supers: list[TypeRef]) -> bool:
+        """If obj should be rendered as a delta, only when its common version is one of its supers."""
+        if self.common_defs is None or self.game == Game.COMMON:
+            return False
+        return any(sup.path() == obj.path() and game == Game.COMMON for sup, game in self.supers(obj, supers))
+
+    def common_ctx(self) -> Context:
+        return Context(Game.COMMON, self.resolver, compact=self.compact)
 
 
-@dataclass
 class TypeRef(BaseDef):
     '''
-    Class for holding data for a type reference and generating string based on current context
+    Class for holding data for a type reference and generating string for a namespace.
+
+    Type refs are immutable flyweights: constructing one returns the shared instance for those fields, so the huge
+    number of identical references (int, Core.Object.Vector, ...) cost one object each, and full names and keys are
+    only built once. Use with_constructors to get a modified ref.
     '''
-    game: Game | None = None
-    type_constructors: list[str] = field(default_factory=list)  # type[], Optional[], etc.
+    __slots__ = ('type_constructors', '_full_name', '_path', '_key')
+
+    _instances: dict[tuple, TypeRef] = {}
+
+    type_constructors: tuple[str, ...]  # type[], Optional[], etc.
+
+    def __new__(cls, names: Iterable[str], package: str, type_cat: TypeCat,
+                type_constructors: Iterable[str] = ()) -> TypeRef:
+        names = tuple(names)
+        type_constructors = tuple(type_constructors)
+        instance_key = (names, package, type_cat, type_constructors)
+        instance = cls._instances.get(instance_key)
+        if instance is None:
+            instance = object.__new__(cls)
+            for attr, value in (('names', names), ('package', package), ('type_cat', type_cat),
+                                ('type_constructors', type_constructors),
+                                ('_full_name', f"{package}.{'.'.join(names)}"), ('_path', (package, *names)),
+                                ('_key', instance_key)):
+                object.__setattr__(instance, attr, value)
+            instance = cls._instances.setdefault(instance_key, instance)
+        return instance
+
+    def __init__(self, *args, **kwargs):
+        # Everything is set up in __new__
+        pass
+
+    def __setattr__(self, name: str, value: object) -> None:
+        raise AttributeError(f"TypeRef is immutable, can't set {name}")
+
+    def __reduce__(self):
+        return TypeRef, (self.names, self.package, self.type_cat, self.type_constructors)
+
+    def __repr__(self) -> str:
+        return f'TypeRef(names={self.names!r}, package={self.package!r}, type_cat={self.type_cat}, ' \
+               f'type_constructors={self.type_constructors!r})'
 
     def __eq__(self, other: object) -> bool:
+        if self is other:
+            return True
         if not isinstance(other, TypeRef):
             return False
-        if self.names == other.names and self.package == other.package and self.type_constructors == other.type_constructors \
-                and self.type_cat == other.type_cat:
-            return True
-        return False
+        return self._key == other._key
 
-    def to_str(self, cls_name: str, cls_game: Game | None = None, super: bool=False) -> str:
-        '''Tries for common prefix if available, reverts to game if not.
-        No prefix if current class context is same as cls.'''
-        if self.game is None:
-            raise ValueError(f"game not set for object {self.name}")
-        use_game = cls_game if cls_game else self.game
+    def __hash__(self) -> int:
+        return hash(self._key)
 
+    def full_name(self) -> str:
+        return self._full_name
+
+    def path(self) -> tuple[str, ...]:
+        return self._path
+
+    def key(self) -> tuple:
+        """Hashable identity consistent with __eq__."""
+        return self._key
 
-        ref = '.'.join([name for name in self.names])
+    def with_constructors(self, *type_constructors: str) -> TypeRef:
+        """Same ref with type constructors added to the end."""
+        return TypeRef(self.names, self.package, self.type_cat, self.type_constructors + type_constructors)
+
+    def to_str(self, game: Game) -> str:
+        '''Reference to the type from the given namespace.'''
         # Builtins don't get class/namespace prefix. CONST is str in Python
-        if self.type_cat not in [TypeCat.BUILTIN, TypeCat.CONST] and use_game is not None:
-            ref = f'{use_game.value}.{ref}'
-        return ref
+        if self.type_cat in [TypeCat.BUILTIN, TypeCat.CONST]:
+            return '.'.join(self.names)
+        return self.ref_str(game)
 
 
-@dataclass
+@dataclass(slots=True)
 class PropertyRef:
     var_name: str
     type_ref: TypeRef
 
-    def _type_additions(self, ref: str, setter: bool) -> str:
-        if 'type' in self.type_ref.type_constructors:
+    def key(self) -> tuple:
+        return self.var_name, self.type_ref.key()
+
+    @staticmethod
+    def render_type(type_ref: TypeRef, game: Game, setter: bool) -> str:
+        """Getter or setter annotation, uncached. Use TYPE_STR_CACHE to get one."""
+        ref = type_ref.to_str(game)
+        if 'type' in type_ref.type_constructors:
             ref = f'type[{ref}]'
         
         # Enums can also accept ints. Users need to figure out which ints are valid.
-        if self.type_ref.type_cat == TypeCat.ENUM:
+        if type_ref.type_cat == TypeCat.ENUM:
             ref = f"{ref} | int"
         
-        tuple_and_size = next((tcon for tcon in self.type_ref.type_constructors if 'tuple' in tcon), None)
+        tuple_and_size = next((tcon for tcon in type_ref.type_constructors if 'tuple' in tcon), None)
 
         # Non arrays can all be None
-        if 'list' not in self.type_ref.type_constructors and not tuple_and_size:
-            if self.type_ref.type_cat in [TypeCat.CLASS, TypeCat.FUNCTION] and setter:
+        if 'list' not in type_ref.type_constructors and not tuple_and_size:
+            if type_ref.type_cat in [TypeCat.CLASS, TypeCat.FUNCTION] and setter:
                 ref = f'{ref} | None'
 
         elif tuple_and_size:
@@ -164,17 +384,16 @@ class PropertyRef:
                 ref = f'tuple[{", ".join(ref for i in range(int(size)))}]'
             if len(ref) > 120: # Arbitrary line length
                 ref = f'Annotated[{ref}, "size: {size}"]'
-        elif 'list' in self.type_ref.type_constructors:
+        elif 'list' in type_ref.type_constructors:
             ref = f'Sequence[{ref}]' if setter else f'list[{ref}]'
-        if 'AttributeProperty' in self.type_ref.type_constructors:
+        if 'AttributeProperty' in type_ref.type_constructors:
             ref = f'Annotated[{ref}, AttributeProperty]'
         return ref
 
-    def to_str(self, cls_name: str, tabs: int, cls_game: Game | None = None) -> str:
-        # cls_game is current class context, used to determine what game return values and getters should use
-        # Only needed here because same type_ref is used for both getters and setters'''
-        getter_ref = self._type_additions(self.type_ref.to_str(cls_name, cls_game), False)
-        setter_ref = self._type_additions(self.type_ref.to_str(cls_name), True)
+    def to_str(self, tabs: int, ctx: Context) -> str:
+        # Getters return the type from the namespace being rendered, setters accept the common version when there is one
+        getter_ref = TYPE_STR_CACHE.get(self.type_ref, ctx.game, TypeRole.GETTER)
+        setter_ref = TYPE_STR_CACHE.get(self.type_ref, ctx.resolve(self.type_ref), TypeRole.SETTER)
 
         tab_str = tabs * '\t'
         lines = []
@@ -186,36 +405,44 @@ class PropertyRef:
             lines.append(f'{tab_str}def {self.var_name}(self, val: {setter_ref}) -> None: ...\n')
         return ''.join(lines)
 
-    def make_struct_arg_str(self, cls_name: str, cls_game: Game):
+    def make_struct_arg_str(self, ctx: Context):
         """Kind of hacky to put this here, but need a place to generate the args for make_struct helper. All args are optional"""
-        type_str = self._type_additions(self.type_ref.to_str(cls_name, None), True)
+        type_str = TYPE_STR_CACHE.get(self.type_ref, ctx.resolve(self.type_ref), TypeRole.SETTER)
         return f"{self.var_name}: {type_str} = ..."
 
 
 
-@dataclass
+@dataclass(slots=True)
 class ParamRef:
     var_name: str
     type_ref: TypeRef
 
-    def type_str(self, cls_name: str,  cls_game: Game | None = None) -> str:
+    def key(self) -> tuple:
+        return self.var_name, self.type_ref.key()
+
+    def type_str(self, game: Game) -> str:
+        """This only returns the type, for params need to use to_str to include the var name"""
+        return TYPE_STR_CACHE.get(self.type_ref, game, TypeRole.PARAM)
+
+    @staticmethod
+    def render_type(type_ref: TypeRef, game: Game) -> str:
         """There's a few instances of out params that are fixed arrays, so we have special logic to handle the double annotation here.
-        This only returns the type, for params need to use to_str to include the var name"""
+        Uncached, use type_str to get one."""
         annotations = []
 
-        ref = self.type_ref.to_str(cls_name, cls_game)
-        if 'type' in self.type_ref.type_constructors:
+        ref = type_ref.to_str(game)
+        if 'type' in type_ref.type_constructors:
             ref = f'type[{ref}]'
 
         # Enums can also accept ints. Users need to figure out which ints are valid.
-        if self.type_ref.type_cat == TypeCat.ENUM:
+        if type_ref.type_cat == TypeCat.ENUM:
             ref = f"{ref} | int"
 
         # Fixed length array handling
-        tuple_and_size = next((tcon for tcon in self.type_ref.type_constructors if 'tuple' in tcon), None)
+        tuple_and_size = next((tcon for tcon in type_ref.type_constructors if 'tuple' in tcon), None)
 
-        if 'list' not in self.type_ref.type_constructors and not tuple_and_size:
-            if self.type_ref.type_cat in [TypeCat.CLASS, TypeCat.FUNCTION]:
+        if 'list' not in type_ref.type_constructors and not tuple_and_size:
+            if type_ref.type_cat in [TypeCat.CLASS, TypeCat.FUNCTION]:
                 ref = f'{ref} | None'
         elif tuple_and_size:
             size = tuple_and_size.split("_")[-1]
@@ -224,57 +451,67 @@ class ParamRef:
         else:  # Params will accept any Sequence
             ref = f'Sequence[{ref}]'
 
-        if 'Out' in self.type_ref.type_constructors:
+        if 'Out' in type_ref.type_constructors:
             annotations.append("OutParam")
 
         if annotations:
             ref = f"Annotated[{ref}, {', '.join(annotations)}]"
         return ref
 
-    def to_str(self, cls_name: str) -> str:
+    def to_str(self, ctx: Context) -> str:
         """There's a few instances of out params that are fixed arrays, so we have special logic to handle the double annotation here."""
-        ref = self.type_str(cls_name)
+        ref = self.type_str(ctx.resolve(self.type_ref))
 
         if 'Optional' in self.type_ref.type_constructors:
             return f'{self.var_name}: {ref} = ...'
         return f'{self.var_name}: {ref}'
 
 
-@dataclass
+@dataclass(slots=True)
 class ReturnRef:
     type_ref: TypeRef
 
-    def to_str(self, cls_name: str, cls_game: Game | None = None, out_params: list[ParamRef] | None = None):
+    def key(self) -> tuple:
+        return self.type_ref.key()
 
-        ref = self.type_ref.to_str(cls_name)
-        if 'type' in self.type_ref.type_constructors:
+    @staticmethod
+    def render_type(type_ref: TypeRef, game: Game) -> str:
+        """Return annotation without out params, uncached. Use TYPE_STR_CACHE to get one."""
+        ref = type_ref.to_str(game)
+        if 'type' in type_ref.type_constructors:
             ref = f'type[{ref}]'
-        if 'list' in self.type_ref.type_constructors:
+        if 'list' in type_ref.type_constructors:
             ref = f'list[{ref}]'
-        if 'Out' in self.type_ref.type_constructors:
+        if 'Out' in type_ref.type_constructors:
             ref = f'Annotated[{ref}, OutParam]'
+        return ref
+
+    def to_str(self, ctx: Context, cls_game: Game | None = None, out_params: list[ParamRef] | None = None):
+        # cls_game puts out params in the class namespace, without it they resolve the same way params do
+        ref = TYPE_STR_CACHE.get(self.type_ref, ctx.game, TypeRole.RETURN)
 
         if out_params:
             # Use type_str method from ParamRef to get the out param type without a var name.
-            out_refs = ', '.join([op.type_str(cls_name, cls_game) for op in out_params])
+            out_refs = ', '.join([op.type_str(cls_game or ctx.resolve(op.type_ref)) for op in out_params])
             ref = 'EllipsisType' if ref == 'None' else ref
             return f'tuple[{ref}, {out_refs}]'
         else:
             return ref
 
 
-@dataclass
+@dataclass(slots=True)
 class EnumDef(BaseDef):
     supers: list[TypeRef] = field(default_factory=list)
     attributes: dict = field(default_factory=dict)
 
-    def to_str(self, cls_game: Game) -> str:
+    def to_str(self, ctx: Context) -> str:
         # if self.full_name() == "Core.Object.EDebugBreakType":
         #     print(self.supers)
 
         lines = []
-        if self.supers:
-            super_str = "(" + ", ".join([sup.to_str(self.name(), super=True) for sup in self.supers]) + ")"
+        supers = ctx.supers_str(self, self.supers)
+        if supers:
+            super_str = "(" + ", ".join(supers) + ")"
         else:
             super_str = '(UnrealEnum)'
         lines.append(f'\tclass {self.name()}{super_str}:\n')
@@ -293,23 +530,26 @@ class EnumDef(BaseDef):
         
         # find_enum helper
         lines.append("\t\t@staticmethod\n")
-        lines.append(f'\t\tdef find_enum(name: Literal["{self.name()}"]) -> {cls_game.value + "." + ".".join(self.names)}: ...')
+        lines.append(f'\t\tdef find_enum(name: Literal["{self.name()}"]) -> {self.ref_str(ctx.game)}: ...')
         lines.append("\n\n")
 
         return "".join(lines)
 
-@dataclass
+@dataclass(slots=True)
 class StructDef(BaseDef):
     supers: list[TypeRef] = field(default_factory=list)
     properties: list[PropertyRef] = field(default_factory=list)
 
-    def to_str(self, cls_name: str, cls_game: Game) -> str:
+    def to_str(self, ctx: Context, base: StructDef | None = None, skipped: list[str] | None = None) -> str:
+        """With base, fields rendering the same as in base are left out and added to skipped."""
         lines = []
-        if self.supers:
-            super_str = "(" + ', '.join([sup.to_str(self.name(), super=True) for sup in self.supers]) + ")"
+        supers = ctx.supers_str(self, self.supers)
+        if supers:
+            super_str = "(" + ', '.join(supers) + ")"
         else:
             super_str = '(WrappedStruct)'
-        prop_arg_refs = [prop.make_struct_arg_str(cls_name, cls_game) for prop in self.properties]
+        prop_arg_refs = [prop.make_struct_arg_str(ctx) for prop in self.properties]
+        base_props = {prop.var_name: prop for prop in base.properties} if base else {}
         lines.append(f'\tclass {self.name()}{super_str}:\n')
         # Docstring
         lines.append(f'\t\t"""\n\t\t{self.full_name()}\n\n')
@@ -318,23 +558,33 @@ class StructDef(BaseDef):
 
         # Properties
         for prop in self.properties:
-            lines.append(prop.to_str(cls_name, 2, cls_game))  # Two tabs because we're in a class in a struct
+            prop_str = prop.to_str(2, ctx)  # Two tabs because we're in a class in a struct
+            base_prop = base_props.get(prop.var_name)
+            if base_prop and skipped is not None and base_prop.to_str(2, ctx.common_ctx()) == prop_str:
+                skipped.append(prop_str)
+            else:
+                lines.append(prop_str)
 
         # make_struct helper
         struct_name = self.full_name() if self.name() in DUPLICATE_STRUCTS else self.name()
         lines.append('\n\t\t@staticmethod\n')
         lines.append(
-            f'\t\tdef make_struct(name: Literal["{struct_name}"], /{", *, " if prop_arg_refs else ""}{", ".join(prop_arg_refs)}) -> {cls_game.value + "." + ".".join(self.names)}: ...')
+            f'\t\tdef make_struct(name: Literal["{struct_name}"], /{", *, " if prop_arg_refs else ""}{", ".join(prop_arg_refs)}) -> {self.ref_str(ctx.game)}: ...')
 
         lines.append('\n\n')
         return ''.join(lines)
 
 
-@dataclass
+@dataclass(slots=True)
 class FunctionDef(BaseDef):
     params: list[ParamRef] = field(default_factory=list)
     ret: ReturnRef | None = None
 
+    def key(self) -> tuple:
+        """Hashable identity consistent with dataclass __eq__, used to match signatures across games."""
+        return (tuple(self.names), self.package, self.type_cat, tuple(param.key() for param in self.params),
+                self.ret.key() if self.ret else None)
+
     def _get_out_params(self) -> list[ParamRef]:
         res = []
         for param in self.params:
@@ -342,69 +592,98 @@ class FunctionDef(BaseDef):
                 res.append(param)
         return res
 
-    def _return_str(self, cls_name: str, cls_game: Game | None = None) -> str:
-        out_params = self._get_out_params()
+    def _return_str(self, ctx: Context, out_params: list[ParamRef], cls_game: Game | None = None) -> str:
         if not self.ret:
             return ''
         if out_params:
-            return self.ret.to_str(cls_name, cls_game, out_params)
+            return self.ret.to_str(ctx, cls_game, out_params)
         else:
-            return self.ret.to_str(cls_name)
+            return self.ret.to_str(ctx)
         
-    def _docstr_lines(self, cls_name: str) -> list[str]:
-        docstr_lines = ['\t\t\t"""\n']
+    def _docstr(self, param_strs: list[str], return_str: str, indent: str = '\t\t\t') -> str:
+        docstr_lines = [f'{indent}"""\n']
         if self.params:
-            docstr_lines.append('\t\t\tArgs:\n')
+            docstr_lines.append(f'{indent}Args:\n')
         else:
-            docstr_lines.append('\t\t\tNo args\n')
-        for arg in self.params:
-            docstr_lines.append(f'\t\t\t\t{arg.to_str(cls_name)}\n')
-        docstr_lines.append('\n\t\t\tReturns:\n')
-        docstr_lines.append(f'\t\t\t\t{self._return_str(cls_name)}\n')
-        docstr_lines.append('\t\t\t"""\n\n')
-        return docstr_lines
+            docstr_lines.append(f'{indent}No args\n')
+        for param_str in param_strs:
+            docstr_lines.append(f'{indent}\t{param_str}\n')
+        docstr_lines.append(f'\n{indent}Returns:\n')
+        docstr_lines.append(f'{indent}\t{return_str}\n')
+        docstr_lines.append(f'{indent}"""\n\n')
+        return ''.join(docstr_lines)
         
 
     # Defining function as a class so that we can get args and return values out for hook purposes
-    def to_str(self, cls_name: str,  cls_game: Game | None = None) -> str:
-        
-        lines = []
-        param_refs = ', '.join([param.to_str(cls_name) for param in self.params])
+    def to_str(self, ctx: Context) -> str:
+        if ctx.compact:
+            return self.to_compact_str(ctx)
+        # Params, return and docstring are each rendered once and reused by the metaclass, class, args and ret
+        param_strs = [param.to_str(ctx) for param in self.params]
+        param_refs = ''.join(f', {param_str}' for param_str in param_strs)
+        out_params = self._get_out_params()
+        # Out params are in the class namespace in signatures, the docstring resolves them like the other params
+        ret_str = self._return_str(ctx, out_params, ctx.game)
+        docstr = self._docstr(param_strs, self._return_str(ctx, out_params) if out_params else ret_str)
+        call_str = f'\t\tdef __call__(self{param_refs}) -> {ret_str}:\n'
 
+        lines = []
         # Metaclass
         lines.append(f'\tclass _{self.name()}(type):\n')
-        lines.append(f'\t\tdef __call__(self{", " + param_refs if param_refs else ""}) -> {self._return_str(cls_name, cls_game)}:\n')
-        lines.extend(self._docstr_lines(cls_name))
+        lines.append(call_str)
+        lines.append(docstr)
 
         # Main class
         lines.append(f'\tclass {self.name()}(BoundFunction, metaclass=_{self.name()}):\n')
         lines.append('\t\tdef __init__(self) -> None:\n')
-        lines.extend(self._docstr_lines(cls_name=cls_name))
-        lines.append(f'\t\tdef __call__(self{", " + param_refs if param_refs else ""}) -> {self._return_str(cls_name, cls_game)}:\n')
-        lines.extend(self._docstr_lines(cls_name=cls_name))
+        lines.append(docstr)
+        lines.append(call_str)
+        lines.append(docstr)
 
         # args
         lines.append('\t\tclass args(WrappedStruct):\n')
-        for param in self.params:
-            lines.append(f'\t\t\t{param.to_str(cls_name)}\n')
+        for param_str in param_strs:
+            lines.append(f'\t\t\t{param_str}\n')
         if not self.params:
             lines.append('\t\t\tpass\n')
         lines.append('\n')
         # ret
-        lines.append(f'\t\ttype ret = {self._return_str(cls_name, cls_game)}\n\n')
+        lines.append(f'\t\ttype ret = {ret_str}\n\n')
 
-       
+        return ''.join(lines)
+
+    def to_compact_str(self, ctx: Context) -> str:
+        '''
+        Same typing as to_str with one copy of the docstring and no __init__. The metaclass __call__ types calling the
+        function (pyright, mypy ignores metaclass __call__ in either mode) and the class __call__ types calling a
+        function instance, like one passed to a hook. args and ret are the same as to_str's.
+        '''
+        param_strs = [param.to_str(ctx) for param in self.params]
+        param_refs = ''.join(f', {param_str}' for param_str in param_strs)
+        out_params = self._get_out_params()
+        ret_str = self._return_str(ctx, out_params, ctx.game)
+        call_str = f'\t\tdef __call__(self{param_refs}) -> {ret_str}: ...\n'
+
+        lines = [f'\tclass _{self.name()}(type):\n',
+                 call_str,
+                 f'\tclass {self.name()}(BoundFunction, metaclass=_{self.name()}):\n',
+                 self._docstr(param_strs, self._return_str(ctx, out_params) if out_params else ret_str, '\t\t'),
+                 call_str,
+                 '\t\tclass args(WrappedStruct):\n']
+        lines.extend(f'\t\t\t{param_str}\n' for param_str in param_strs)
+        if not self.params:
+            lines.append('\t\t\tpass\n')
+        lines.append(f'\t\ttype ret = {ret_str}\n\n')
         return ''.join(lines)
 
 
-@dataclass
+@dataclass(slots=True)
 class ClassDef(BaseDef):
     supers: list[TypeRef] = field(default_factory=list)
     enums: list[EnumDef] = field(default_factory=list)
     structs: list[StructDef] = field(default_factory=list)
     properties: list[PropertyRef] = field(default_factory=list)
     functions: list[FunctionDef] = field(default_factory=list)
-    game: Game | None = None
 
     def get_full_names(self) -> list[str]:
         names = [self.full_name()]
@@ -413,109 +692,98 @@ class ClassDef(BaseDef):
         names.extend(func.full_name() for func in self.functions)  # I guess we need these for DelegateProperties to reference.
         return names
 
-    def set_game(self, try_game: Game, common_full_names: list[str]):
-        self.game = try_game
-
-        # Supers - add common version if available. Skip if already there or if we're setting to common.
-        for sup in self.supers:
-            if self.name() == sup.name():
-                sup.game = Game.COMMON
-            else:
-                sup.game = try_game
-        if try_game != Game.COMMON and self.name() not in [sup.name() for sup in self.supers] and self.full_name() in common_full_names:
-            self.supers = [TypeRef(self.names, self.package, self.type_cat, Game.COMMON)] + self.supers
-
-        # Enums
+    def imports(self, ctx: Context) -> list[str]:
+        '''
+        Import statements of the classes the class's file references, its edges in the class dependency graph. Files
+        import only these instead of whole namespaces. In delta mode members that are left out still count.
+        '''
+        refs: list[tuple[BaseDef, Game]] = [(self, ctx.game)] if self.enums or self.structs else []  # find_enum, make_struct
+        refs.extend(ctx.supers(self, self.supers))
         for enum in self.enums:
-            if try_game != Game.COMMON and enum.full_name() in common_full_names:
-                enum.supers = [TypeRef(enum.names, enum.package, enum.type_cat, Game.COMMON)]
-            
-        # Structs
+            refs.extend(ctx.supers(enum, enum.supers))
+        props = list(self.properties)
         for struct in self.structs:
-            for sup in struct.supers:
-                if struct.name() == sup.name():
-                    sup.game = Game.COMMON
-                else:
-                    sup.game = try_game
-            if try_game != Game.COMMON and struct.name() not in [sup.name() for sup in
-                                                                 struct.supers] and struct.full_name() in common_full_names:
-                struct.supers = [TypeRef(struct.names, struct.package, struct.type_cat, Game.COMMON)] + struct.supers
-            for prop in struct.properties:
-                if prop.type_ref.full_name() in common_full_names:
-                    prop.type_ref.game = Game.COMMON
-                else:
-                    prop.type_ref.game = try_game
-
-        # Properties
-        for prop in self.properties:
-            if prop.type_ref.full_name() in common_full_names:
-                prop.type_ref.game = Game.COMMON
-            else:
-                prop.type_ref.game = try_game
-
-        # Functions
+            refs.extend(ctx.supers(struct, struct.supers))
+            props.extend(struct.properties)
+        for prop in props:
+            refs.append((prop.type_ref, ctx.game))
+            refs.append((prop.type_ref, ctx.resolve(prop.type_ref)))
         for func in self.functions:
-
             for param in func.params:
-                if param.type_ref.full_name() in common_full_names:
-                    param.type_ref.game = Game.COMMON
-                else:
-                    param.type_ref.game = try_game
+                refs.append((param.type_ref, ctx.resolve(param.type_ref)))
+                if 'Out' in param.type_ref.type_constructors:  # In the return type, in the class namespace
+                    refs.append((param.type_ref, ctx.game))
             if func.ret:
-                func.ret.type_ref.game = try_game
-            # if func.name() == 'ClearResourcePoolReference' and try_game == Game.BL2:
-            #     x=1
-
-    def to_str(self) -> str:
-        if self.game is None:
-            raise ValueError(f"game not set for object {self.name}")
+                refs.append((func.ret.type_ref, ctx.game))
+        return sorted({ref.import_str(game) for ref, game in refs
+                       if ref.type_cat not in [TypeCat.BUILTIN, TypeCat.CONST]})
+
+    def to_str(self, ctx: Context, skipped: list[str] | None = None) -> str:
+        """In delta mode the text of members left out is added to skipped."""
+        skipped = [] if skipped is None else skipped
+        skipped_members = []  # Class level properties and functions only, struct fields don't empty the class
+        base = ctx.common_defs.get(self.full_name()) if ctx.delta_base(self, self.supers) else None
+        base_ctx = ctx.common_ctx() if base else None
+
+        def render_member(member_str: str, base_member: PropertyRef | FunctionDef | None) -> str:
+            if base_member and member_str == (base_member.to_str(1, base_ctx) if isinstance(base_member, PropertyRef)
+                                              else base_member.to_str(base_ctx)):
+                skipped.append(member_str)
+                skipped_members.append(member_str)
+                return ''
+            return member_str
 
         lines = copy(DEFAULT_IMPORTS)
 
-        lines.append('import common\n')
-        if self.game != Game.COMMON and self.game is not None:
-            lines.append(f'import {self.game.value}')
+        lines.extend(self.imports(ctx))
         lines.append('\n\n')
 
         # Class def and supers
-        super_str = ', '.join([sup.to_str(self.name(), super=True) for sup in self.supers])
-        if self.name() == 'Object' and self.game == Game.COMMON:
+        super_str = ', '.join(ctx.supers_str(self, self.supers))
+        if self.name() == 'Object' and ctx.game == Game.COMMON:
             super_str = 'UClass'
         lines.append(f'class {self.name()}{f"({super_str})" if super_str else ""}:\n')
 
         # Enums
         for enum in self.enums:
-            lines.append(enum.to_str(self.game))
+            lines.append(enum.to_str(ctx))
 
         # Structs
+        base_structs = {struct.name(): struct for struct in base.structs} if base else {}
         deferred_struct_lines = []
         for struct in self.structs:
-            for sup in struct.supers:
+            base_struct = base_structs.get(struct.name()) if ctx.delta_base(struct, struct.supers) else None
+            struct_str = struct.to_str(ctx, base_struct, skipped)
+            for sup, _ in ctx.supers(struct, struct.supers):
                 if sup.name() == struct.name():
-                    deferred_struct_lines.append(struct.to_str(self.name(), self.game))
+                    deferred_struct_lines.append(struct_str)
                     break
             else:
-                lines.append(struct.to_str(self.name(), self.game))
+                lines.append(struct_str)
         lines.extend(deferred_struct_lines)
 
         # Properties
+        base_props = {prop.var_name: prop for prop in base.properties} if base else {}
         deferred_properties_functions = []
         for prop in self.properties:
+            prop_str = render_member(prop.to_str(1, ctx), base_props.get(prop.var_name))
             if prop.var_name == self.name() or prop.var_name in BUILTINS:
-                deferred_properties_functions.append(prop.to_str(self.name(), 1, self.game))
+                deferred_properties_functions.append(prop_str)
             else:
-                lines.append(prop.to_str(self.name(), 1, self.game))
+                lines.append(prop_str)
         lines.append('\n\n')
 
         # Functions
+        base_funcs = {func.name(): func for func in base.functions} if base else {}
         for func in self.functions:
+            func_str = render_member(func.to_str(ctx), base_funcs.get(func.name()))
             if func.name() == self.name() or func.name() in BUILTINS:
-                deferred_properties_functions.append(func.to_str(self.name(), self.game))
+                deferred_properties_functions.append(func_str)
             else:
-                lines.append(func.to_str(self.name(), self.game))
+                lines.append(func_str)
         lines.extend(deferred_properties_functions)
 
-        if len(self.properties) + len(self.functions) + len(self.structs) + len(self.enums) == 0:
+        if len(self.properties) + len(self.functions) + len(self.structs) + len(self.enums) == len(skipped_members):
             lines.append('\tpass\n')
 
         # return lines
@@ -0,0 +1,252 @@
+'''Pure Python stand-in for unrealsdk that serves an object graph recorded by object_graph.record_object_graph.
+
+install() registers it as unrealsdk, unrealsdk.unreal, unrealsdk.logging and unrealsdk.hooks, after which
+game_class_defs imports and runs like it does in game. Only the parts of the SDK the extraction uses are there:
+find_all, the reflection fields, _get_address/_path_name, UEnum.GetEnum/_as_py, logging and hook registration.
+
+    python -m src.fake_unrealsdk BL2_object_graph.bin -o BL2_class_defs.ir --profile
+'''
+from __future__ import annotations
+
+import argparse
+import cProfile
+import enum
+import pstats
+import sys
+import time
+import types
+from typing import Any, Callable, Iterator, NamedTuple
+
+from .object_graph import NO_REF, ObjectRecord, read_object_graph
+from .runner import register_module
+
+ADDRESS_BASE = 0x10000000
+ADDRESS_STRIDE = 0x40
+
+
+class UObject:
+    __slots__ = ('_graph', '_index', 'Name', '_class_idx', '_outer_idx', '_refs', '_values')
+
+    def __init__(self, graph: ObjectGraph, index: int, record: ObjectRecord):
+        self._graph = graph
+        self._index = index
+        self.Name, self._class_idx, self._outer_idx, self._refs, self._values, _ = record
+
+    @property
+    def Class(self) -> UClass:
+        return self._graph.objects[self._class_idx]
+
+    @property
+    def Outer(self) -> UObject | None:
+        return None if self._outer_idx == NO_REF else self._graph.objects[self._outer_idx]
+
+    def __getattr__(self, name: str) -> Any:
+        idx = self._refs.get(name)
+        if idx is not None:
+            return None if idx == NO_REF else self._graph.objects[idx]
+        if name in self._values:
+            return self._values[name]
+        raise AttributeError(f'{self.Class.Name} {self.Name} has no field {name}')
+
+    def __repr__(self) -> str:
+        return f"{self.Class.Name}'{self._path_name()}'"
+
+    def _get_address(self) -> int:
+        return ADDRESS_BASE + self._index * ADDRESS_STRIDE
+
+    def _path_name(self) -> str:
+        names = [self.Name]
+        outer = self.Outer
+        while outer:
+            names.append(outer.Name)
+            outer = outer.Outer
+        return '.'.join(reversed(names))
+
+
+class UField(UObject):
+    __slots__ = ()
+
+
+class UConst(UField):
+    __slots__ = ()
+
+
+class UProperty(UField):
+    __slots__ = ()
+
+
+class UStruct(UField):
+    __slots__ = ()
+
+
+class UScriptStruct(UStruct):
+    __slots__ = ()
+
+
+class UFunction(UStruct):
+    __slots__ = ()
+
+
+class UClass(UStruct):
+    __slots__ = ()
+
+
+class PyEnumMember(NamedTuple):
+    name: str
+    value: int
+
+
+class PyEnum:
+    """Just the __members__ of the python enum _as_py returns. Building a real enum class per UEnum takes longer than
+    the rest of the extraction, which would throw off profiles."""
+
+    def __init__(self, name: str, values: dict[str, int]):
+        self.__name__ = name
+        self.__members__ = {member: PyEnumMember(member, value) for member, value in values.items()}
+
+
+class UEnum(UField):
+    __slots__ = ('_enum_values', '_py_enum')
+
+    def __init__(self, graph: ObjectGraph, index: int, record: ObjectRecord):
+        super().__init__(graph, index, record)
+        self._enum_values: dict[str, int] = record[5] or {}
+        self._py_enum: PyEnum | None = None
+
+    def GetEnum(self, enum_obj: UEnum, idx: int) -> str:
+        names = list(enum_obj._enum_values)
+        return names[idx] if idx < len(names) else 'None'
+
+    def _as_py(self) -> PyEnum:
+        if self._py_enum is None:
+            self._py_enum = PyEnum(self.Name, self._enum_values)
+        return self._py_enum
+
+
+OBJECT_TYPES: dict[str, type[UObject]] = {
+    'Class': UClass,
+    'ScriptStruct': UScriptStruct,
+    'Function': UFunction,
+    'State': UStruct,
+    'Enum': UEnum,
+    'Const': UConst,
+}
+
+
+def _object_type(class_name: str) -> type[UObject]:
+    if class_name in OBJECT_TYPES:
+        return OBJECT_TYPES[class_name]
+    return UProperty if class_name.endswith('Property') else UObject
+
+
+class ObjectGraph:
+    """A recorded graph, every object is built up front and fields are resolved by index when read."""
+
+    def __init__(self, records: list[ObjectRecord]):
+        # Object types come from class names, and class objects can come after the objects using them
+        class_names = [records[class_idx][0] for _, class_idx, *_ in records]
+        self.objects: list[UObject] = [_object_type(class_name)(self, idx, record)
+                                       for idx, (class_name, record) in enumerate(zip(class_names, records))]
+        self._by_class: dict[str, list[UObject]] = {}
+        for obj in self.objects:
+            self._by_class.setdefault(obj.Class.Name, []).append(obj)
+
+    def find_all(self, cls: UClass | str, exact: bool = True) -> Iterator[UObject]:
+        class_name = cls if isinstance(cls, str) else cls.Name
+        if exact:
+            yield from self._by_class.get(class_name, [])
+            return
+        for obj in self.objects:
+            cls_obj: UObject | None = obj.Class
+            while cls_obj is not None:
+                if cls_obj.Name == class_name:
+                    yield obj
+                    break
+                cls_obj = cls_obj.SuperField
+
+
+class FakeHooks:
+    """Hook registration without a game. run() calls the hooks of a function, so tick driven tasks can be stepped."""
+
+    class Type(enum.Enum):
+        PRE = 0
+        POST = 1
+        POST_UNCONDITIONAL = 2
+
+    def __init__(self):
+        self.hooks: dict[tuple[str, Type, str], Callable[..., Any]] = {}
+
+    def add_hook(self, func: str, hook_type: Type, identifier: str, callback: Callable[..., Any]) -> None:
+        self.hooks[(func, hook_type, identifier)] = callback
+
+    def has_hook(self, func: str, hook_type: Type, identifier: str) -> bool:
+        return (func, hook_type, identifier) in self.hooks
+
+    def remove_hook(self, func: str, hook_type: Type, identifier: str) -> bool:
+        return self.hooks.pop((func, hook_type, identifier), None) is not None
+
+    def run(self, func: str, hook_type: Type = Type.PRE, *args: Any) -> None:
+        for (hook_func, hook_type_, _), callback in list(self.hooks.items()):
+            if hook_func == func and hook_type_ == hook_type:
+                callback(*args)
+
+
+def _log(*args: Any) -> None:
+    print(*args)
+
+
+def install(path: str) -> ObjectGraph:
+    """Load a recorded graph and register the fake unrealsdk modules serving it. Returns the graph."""
+    graph = ObjectGraph(read_object_graph(path))
+    hooks = FakeHooks()
+
+    sdk = types.ModuleType('unrealsdk')
+    sdk.find_all = graph.find_all
+    unreal = types.ModuleType('unrealsdk.unreal')
+    for cls in (UObject, UField, UConst, UProperty, UStruct, UScriptStruct, UFunction, UClass, UEnum):
+        setattr(unreal, cls.__name__, cls)
+    logging = types.ModuleType('unrealsdk.logging')
+    for level in ('info', 'warning', 'error', 'misc', 'dev_warning'):
+        setattr(logging, level, _log)
+    hooks_module = types.ModuleType('unrealsdk.hooks')
+    hooks_module.Type = FakeHooks.Type
+    for name in ('add_hook', 'has_hook', 'remove_hook', 'run'):
+        setattr(hooks_module, name, getattr(hooks, name))
+
+    sdk.unreal, sdk.logging, sdk.hooks = unreal, logging, hooks_module
+    sys.modules.update({'unrealsdk': sdk, 'unrealsdk.unreal': unreal, 'unrealsdk.logging': logging,
+                        'unrealsdk.hooks': hooks_module})
+    return graph
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the class def extraction on a recorded object graph.')
+    parser.add_argument('graph', help='Object graph recorded in game with bps --record.')
+    parser.add_argument('-o', '--out', help='Write the class defs to this IR file.')
+    parser.add_argument('-p', '--profile', action='store_true', help='Profile get_class_defs and print the top calls.')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    graph = install(args.graph)
+    print(f'Loaded {len(graph.objects)} objects in {time.perf_counter() - start:.2f}s')
+
+    from .definitions import OUTER_CHAIN_CACHE
+    from .game_class_defs import clear_caches, get_class_defs
+    from .ir_file import write_ir
+
+    clear_caches()
+    profiler = cProfile.Profile() if args.profile else None
+    start = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    class_defs = get_class_defs()
+    if profiler:
+        profiler.disable()
+    print(f'Extracted {len(class_defs)} classes in {time.perf_counter() - start:.2f}s')
+    print(OUTER_CHAIN_CACHE.stats_str())
+    if profiler:
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+    if args.out:
+        write_ir(args.out, class_defs)
+
+register_module(__name__)
@@ -9,7 +9,4 @@ class Game(Enum):
     COMMON = 'common'
 
 
-# Only used for game_class_defs.py, set in that game's file only, don't copy this one over.
-GAME = Game.BL2
-
 register_module(__name__)
\ No newline at end of file
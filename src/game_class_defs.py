@@ -1,12 +1,16 @@
-from typing import cast
+import os
+import shutil
+from collections import defaultdict
+from fnmatch import fnmatchcase
+from typing import Iterable, Iterator, cast
 
 from .runner import register_module
-from .definitions import ClassDef, EnumDef, FunctionDef, ParamRef, PropertyRef, ReturnRef, StructDef,  TypeCat, TypeRef
-from .game import Game, GAME
+from .definitions import OUTER_CHAIN_CACHE, BaseDef, ClassDef, EnumDef, FunctionDef, ParamRef, PropertyRef, ReturnRef, StructDef,  TypeCat, TypeRef
+from .ir_file import IRWriter, iter_combine_shards, read_shard_index, shard_path, write_shard_index
 
 from unrealsdk import find_all
 from unrealsdk.logging import info
-from unrealsdk.unreal import UClass, UEnum, UField, UFunction, UProperty, UStruct
+from unrealsdk.unreal import UClass, UEnum, UField, UFunction, UObject, UProperty, UStruct
 
 # Define the EPropertyFlags as constants
 CPF_Parm = 0x80  # Function parameter
@@ -59,8 +63,7 @@ IGNORE_PROPERTIES = (
 
 def get_property_ref(prop: UProperty) -> PropertyRef:
     if prop.Class.Name == 'ArrayProperty':
-        type_ref = get_property_ref(prop.Inner).type_ref
-        type_ref.type_constructors += ['list']
+        type_ref = get_property_ref(prop.Inner).type_ref.with_constructors('list')
     elif prop.Class.Name == 'StructProperty':
         type_ref = TypeRef.from_uobject(prop.Struct)
     elif prop.Class.Name in ['ObjectProperty', 'ComponentProperty']:
@@ -74,12 +77,12 @@ def get_property_ref(prop: UProperty) -> PropertyRef:
     elif prop.Class.Name == 'DelegateProperty':
         type_ref = TypeRef.from_uobject(prop.Signature)
     elif prop.Class.Name == 'Const':
-        type_ref = TypeRef(names=['str'], package='BUILTIN', type_cat=TypeCat.CONST, game=Game.COMMON)
+        type_ref = TypeRef(names=['str'], package='BUILTIN', type_cat=TypeCat.CONST)
     elif prop.Class.Name in BASIC_TYPES.keys():
-        type_ref = TypeRef(names=[BASIC_TYPES[prop.Class.Name]], package='BUILTIN', type_cat=TypeCat.BUILTIN, game=Game.COMMON)
+        type_ref = TypeRef(names=[BASIC_TYPES[prop.Class.Name]], package='BUILTIN', type_cat=TypeCat.BUILTIN)
     elif prop.Class.Name in ATTRIBUTE_TYPES.keys():
-        type_ref = TypeRef(names=[ATTRIBUTE_TYPES[prop.Class.Name]], package='BUILTIN', type_cat=TypeCat.BUILTIN, game=Game.COMMON)
-        type_ref.type_constructors = ['AttributeProperty']
+        type_ref = TypeRef(names=[ATTRIBUTE_TYPES[prop.Class.Name]], package='BUILTIN', type_cat=TypeCat.BUILTIN,
+                           type_constructors=['AttributeProperty'])
     else:
         info(prop.Name)
         info(prop.Class.Name)
@@ -88,7 +91,7 @@ def get_property_ref(prop: UProperty) -> PropertyRef:
 
 
     if hasattr(prop, "ArrayDim") and prop.ArrayDim > 1:
-        type_ref.type_constructors += [f'tuple_{prop.ArrayDim}']
+        type_ref = type_ref.with_constructors(f'tuple_{prop.ArrayDim}')
 
 
     return PropertyRef(var_name=prop.Name, type_ref=type_ref)
@@ -108,18 +111,22 @@ def get_function_def(func: UFunction) -> FunctionDef:
                 param_ref = ParamRef(var_name=prop.Name, type_ref=prop_ref.type_ref)
                 # Adjust for out and optional params
                 if 'OutParm' in flags:
-                    param_ref.type_ref.type_constructors.append('Out')
+                    param_ref.type_ref = param_ref.type_ref.with_constructors('Out')
                 if 'OptionalParm' in flags:
-                    param_ref.type_ref.type_constructors.append('Optional')
+                    param_ref.type_ref = param_ref.type_ref.with_constructors('Optional')
                 func_type.params.append(param_ref)
         prop = prop.Next
     if not func_type.ret:
-        func_type.ret = ReturnRef(TypeRef(['None'], 'BUILTIN', TypeCat.BUILTIN, Game.COMMON, []))
+        func_type.ret = ReturnRef(TypeRef(['None'], 'BUILTIN', TypeCat.BUILTIN))
     return func_type
 
 
-def get_enum_def(enum: UEnum) -> EnumDef:
-    # Logic taken from Apple's Enum library
+# Enum values by enum address, cleared with clear_caches()
+ENUM_VALUES_CACHE: dict[int, dict[str, int]] = {}
+
+
+def get_enum_values_by_call(enum: UEnum) -> dict[str, int]:
+    # Logic taken from Apple's Enum library. One unrealscript call per value.
     values = {}
     idx = 0
     while True:
@@ -128,9 +135,47 @@ def get_enum_def(enum: UEnum) -> EnumDef:
             break
         values[val_name] = idx
         idx += 1
+    return values
+
+
+def get_enum_values_bulk(enum: UEnum) -> dict[str, int]:
+    # The SDK reads the whole name table natively when it builds the python enum
+    return {name: member.value for name, member in enum._as_py().__members__.items()}
+
+
+def get_enum_values(enum: UEnum) -> dict[str, int]:
+    key = enum._get_address()
+    values = ENUM_VALUES_CACHE.get(key)
+    if values is None:
+        try:
+            values = get_enum_values_bulk(enum)
+        except Exception:
+            values = get_enum_values_by_call(enum)
+        ENUM_VALUES_CACHE[key] = values
+    return dict(values)
+
+
+def check_enum_values() -> int:
+    """Compares bulk and per call enum extraction for every enum in the game. Logs and returns the mismatch count."""
+    mismatches = 0
+    enums = list(find_all('Enum'))
+    for enum in enums:
+        enum = cast(UEnum, enum)
+        by_call = get_enum_values_by_call(enum)
+        try:
+            bulk = get_enum_values_bulk(enum)
+        except Exception as e:
+            bulk = f'{type(e).__name__}: {e}'
+        if bulk != by_call:
+            mismatches += 1
+            info(f'Enum mismatch for {enum._path_name()}: bulk {bulk}, by call {by_call}')
+    info(f'Checked {len(enums)} enums, {mismatches} mismatches')
+    return mismatches
 
+
+def get_enum_def(enum: UEnum) -> EnumDef:
     enum_type = EnumDef.from_uobject(enum)
-    enum_type.attributes = values
+    enum_type.attributes = get_enum_values(enum)
     return enum_type
 
 
@@ -150,11 +195,8 @@ def get_struct_def(struct: UStruct) -> StructDef:
 
 def get_class_def(cls: UClass) -> ClassDef:
     class_def = ClassDef.from_uobject(cls)
-    class_def.game = GAME
     if cls.SuperField:
-        cls_super = TypeRef.from_uobject(cls.SuperField)
-        cls_super.game = GAME
-        class_def.supers = [cls_super]
+        class_def.supers = [TypeRef.from_uobject(cls.SuperField)]
 
     prop: UField | None = cls.Children  # Linked list
     while prop:
@@ -174,17 +216,96 @@ def get_class_def(cls: UClass) -> ClassDef:
     return class_def
 
 
-def get_class_defs():
-    classes = find_all('Class')
+def clear_caches() -> None:
+    """Reset the per-run extraction caches."""
+    OUTER_CHAIN_CACHE.clear()
+    ENUM_VALUES_CACHE.clear()
+
 
-    class_defs = []
+def iter_class_defs(classes: Iterable[UObject]) -> Iterator[ClassDef]:
     for cls in classes:
         # if cls.Name in ('WillowPawn', 'Object'):
-        class_defs.append(get_class_def(cast(UClass, cls)))
-
-    return class_defs
+        yield get_class_def(cast(UClass, cls))
 
 
+def get_class_defs():
+    return list(iter_class_defs(find_all('Class')))
+
+
+def is_subclass_of(cls: UClass, names: Iterable[str]) -> bool:
+    """If the class or one of its supers is named one of names."""
+    names = set(names)
+    sup: UClass | None = cls
+    while sup:
+        if sup.Name in names:
+            return True
+        sup = cast(UClass, sup.SuperField)
+    return False
+
+
+def filter_classes(classes: Iterable[UObject], packages: Iterable[str] = (), name_globs: Iterable[str] = (),
+                   subclass_of: Iterable[str] = ()) -> list[UClass]:
+    """Classes matching every filter given: in one of packages, name matching one of name_globs (case-sensitive, like
+    the class names) and a subclass of one of subclass_of. A filter left empty matches everything."""
+    packages, name_globs, subclass_of = set(packages), list(name_globs), list(subclass_of)
+    res = []
+    for cls in classes:
+        if packages and BaseDef.from_uobject(cls).package not in packages:
+            continue
+        if name_globs and not any(fnmatchcase(cls.Name, glob) for glob in name_globs):
+            continue
+        if subclass_of and not is_subclass_of(cast(UClass, cls), subclass_of):
+            continue
+        res.append(cast(UClass, cls))
+    return res
+
+
+def get_classes_by_package() -> dict[str, list[UClass]]:
+    packages: dict[str, list[UClass]] = defaultdict(list)
+    for cls in find_all('Class'):
+        packages[BaseDef.from_uobject(cls).package].append(cast(UClass, cls))
+    return packages
+
+
+def prepare_shard_dir(shard_dir: str, restart: bool = False) -> list[str]:
+    """Creates the shard dir, or clears it when restarting. Returns the packages already finished by an earlier run."""
+    if restart and os.path.exists(shard_dir):
+        shutil.rmtree(shard_dir)
+    os.makedirs(shard_dir, exist_ok=True)
+
+    finished = read_shard_index(shard_dir)
+    if finished:
+        info(f'Resuming extraction, {len(finished)} packages already done')
+    return finished
+
+
+def iter_sharded_extraction(shard_dir: str, out_path: str, packages: dict[str, list[UClass]]) -> Iterator[None]:
+    """Streaming version of get_class_defs, yields once per class extracted and once per table block read and class
+    combined. Each class is encoded into its package's shard in shard_dir as it's extracted. The shard is written and
+    recorded in the shard index once the package is done, so only one package of encoded classes is in memory at a time
+    and an interrupted run can skip the packages already in the index.
+    Once every package is done the shards are combined into out_path and the shard dir is removed. Finishing a shard or
+    out_path only writes its last table block and class index."""
+    finished = read_shard_index(shard_dir)
+    for pkg, classes in packages.items():
+        if pkg in finished:
+            continue
+        with IRWriter(shard_path(shard_dir, pkg)) as writer:
+            for class_def in iter_class_defs(classes):
+                writer.add(class_def)
+                yield
+        finished.append(pkg)
+        write_shard_index(shard_dir, finished)
+        info(f'Wrote {pkg} ({len(classes)} classes), {len(finished)}/{len(packages)} packages done')
+
+    yield from iter_combine_shards(shard_dir, out_path)
+    shutil.rmtree(shard_dir)
+
+
+def extract_class_defs_sharded(shard_dir: str, out_path: str, restart: bool = False) -> None:
+    prepare_shard_dir(shard_dir, restart)
+    for _ in iter_sharded_extraction(shard_dir, out_path, get_classes_by_package()):
+        pass
 
 
 register_module(__name__)
\ No newline at end of file
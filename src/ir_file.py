@@ -0,0 +1,439 @@
+'''Compact file format for lists of ClassDef, used instead of pickling the dataclass graph between stages.
+
+Layout:
+    MAGIC, FORMAT_VERSION, trailer offset   (struct PREAMBLE_FMT + TRAILER_OFFSET_FMT)
+    class records and table blocks          (marshal, one per class or block) in the order they were written
+    trailer                                 (marshal) table block locations and the class index
+
+Every string (names, packages, var names, type constructors, enum values) is stored once in the string table and
+referenced by position. Type refs are stored once in the type table as tuples of string ids and referenced by position
+from properties, params, returns and supers. Class records can be read on their own, so a single class or package
+can be loaded without decoding the rest of the file.
+
+Records are written as classes are added and the tables in blocks of the entries added since the last one, so closing
+a file only writes the last block and the trailer. Reading the tables takes the blocks in order.
+
+Version 1 and 2 files have the header (strings, types and the class index) right after MAGIC, the version and the
+header length, before the records. They're still read. Version 1 files also stored a game on classes and type refs,
+the games are dropped since the namespace is now chosen when rendering.
+'''
+from __future__ import annotations
+
+import argparse
+import json
+import marshal
+import os
+import pickle
+import struct
+from typing import Generator, Iterable, Iterator, Sequence
+
+from .definitions import ClassDef, EnumDef, FunctionDef, ParamRef, PropertyRef, ReturnRef, StructDef, TypeCat, TypeRef
+from .runner import register_module
+
+MAGIC = b'BPSIR'
+FORMAT_VERSION = 3
+READ_VERSIONS = (1, 2, 3)
+PREAMBLE_FMT = '<5sH'
+TRAILER_OFFSET_FMT = '<Q'
+HEADER_LEN_FMT = '<I'  # Versions 1 and 2
+TABLE_BLOCK_SIZE = 4096  # New strings and types written per table block
+NO_REF = -1
+SHARD_INDEX_NAME = 'index.json'
+
+
+class _Encoder:
+    def __init__(self):
+        self.strings: dict[str, int] = {}
+        self.types: dict[tuple, int] = {}
+        # Added since the last table block
+        self.new_strings: list[str] = []
+        self.new_types: list[tuple] = []
+
+    def string(self, value: str) -> int:
+        idx = self.strings.get(value)
+        if idx is None:
+            idx = self.strings[value] = len(self.strings)
+            self.new_strings.append(value)
+        return idx
+
+    def names(self, names: Sequence[str]) -> tuple[int, ...]:
+        return tuple(self.string(name) for name in names)
+
+    def type_ref(self, type_ref: TypeRef) -> int:
+        # Keyed by the ref's own key, so lookups build nothing and dropping the table doesn't free a tuple per type
+        idx = self.types.get(type_ref.key())
+        if idx is None:
+            idx = self.types[type_ref.key()] = len(self.types)
+            self.new_types.append((self.names(type_ref.names), self.string(type_ref.package), type_ref.type_cat.value,
+                                   self.names(type_ref.type_constructors)))
+        return idx
+
+    def base(self, base_def) -> tuple:
+        return self.names(base_def.names), self.string(base_def.package), base_def.type_cat.value
+
+    def properties(self, props: list[PropertyRef] | list[ParamRef]) -> tuple:
+        return tuple((self.string(prop.var_name), self.type_ref(prop.type_ref)) for prop in props)
+
+    def class_def(self, class_def: ClassDef) -> tuple:
+        return (
+            self.base(class_def),
+            tuple(self.type_ref(sup) for sup in class_def.supers),
+            tuple((self.base(enum), tuple(self.type_ref(sup) for sup in enum.supers),
+                   tuple((self.string(name), value) for name, value in enum.attributes.items()))
+                  for enum in class_def.enums),
+            tuple((self.base(struct_def), tuple(self.type_ref(sup) for sup in struct_def.supers),
+                   self.properties(struct_def.properties))
+                  for struct_def in class_def.structs),
+            self.properties(class_def.properties),
+            tuple((self.base(func), self.properties(func.params), self.type_ref(func.ret.type_ref) if func.ret else NO_REF)
+                  for func in class_def.functions),
+        )
+
+
+class IRWriter:
+    '''
+    Builds an IR file one class at a time. Each class is encoded and written as it's added, and the string and type
+    tables every TABLE_BLOCK_SIZE new entries, so close() only writes the last table block and the trailer.
+    The file is written to a temp path and moved into place, so a crash never leaves a partial file behind. Leaving
+    the with block through an exception removes the temp file.
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self._encoder = _Encoder()
+        self._blocks: list[tuple[int, int]] = []
+        self._index: list[tuple[str, str, int, int]] = []
+        self._data_start = struct.calcsize(PREAMBLE_FMT) + struct.calcsize(TRAILER_OFFSET_FMT)
+        self._file = open(f'{path}.tmp', 'wb')
+        self._file.write(struct.pack(PREAMBLE_FMT, MAGIC, FORMAT_VERSION))
+        self._file.write(struct.pack(TRAILER_OFFSET_FMT, 0))  # Filled in on close
+
+    def __enter__(self) -> IRWriter:
+        return self
+
+    def __exit__(self, exc_type, *args) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            os.remove(f'{self.path}.tmp')
+
+    def _write(self, data: bytes) -> tuple[int, int]:
+        """Offset from the data start and size of the written data."""
+        offset = self._file.tell() - self._data_start
+        self._file.write(data)
+        return offset, len(data)
+
+    def _write_table_block(self) -> None:
+        encoder = self._encoder
+        self._blocks.append(self._write(marshal.dumps((tuple(encoder.new_strings), tuple(encoder.new_types)))))
+        encoder.new_strings.clear()
+        encoder.new_types.clear()
+
+    def add(self, class_def: ClassDef) -> None:
+        offset, size = self._write(marshal.dumps(self._encoder.class_def(class_def)))
+        self._index.append((class_def.full_name(), class_def.package, offset, size))
+        if len(self._encoder.new_strings) + len(self._encoder.new_types) >= TABLE_BLOCK_SIZE:
+            self._write_table_block()
+
+    def close(self) -> None:
+        self._write_table_block()
+        trailer_offset = self._file.tell()
+        self._file.write(marshal.dumps((tuple(self._blocks), tuple(self._index))))
+        self._file.seek(struct.calcsize(PREAMBLE_FMT))
+        self._file.write(struct.pack(TRAILER_OFFSET_FMT, trailer_offset))
+        self._file.close()
+        os.replace(f'{self.path}.tmp', self.path)
+
+
+def write_ir(path: str, class_defs: list[ClassDef]) -> None:
+    with IRWriter(path) as writer:
+        for class_def in class_defs:
+            writer.add(class_def)
+
+
+def iter_write_ir(path: str, class_defs: Iterable[ClassDef]) -> Iterator[None]:
+    """Steps of write_ir, yields once per class written so it can be run a few classes per tick. class_defs can be a
+    generator that builds them, like iter_class_defs."""
+    with IRWriter(path) as writer:
+        for class_def in class_defs:
+            writer.add(class_def)
+            yield
+
+
+class IRReader:
+    '''
+    Reads a file written by write_ir. Only the class index is read on open (the whole header for versions 1 and 2),
+    the tables when the first class is loaded and classes are decoded on request.
+    Every load returns new defs, only the immutable TypeRefs are shared.
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        magic, version = self._unpack(PREAMBLE_FMT)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a class def IR file')
+        if version not in READ_VERSIONS:
+            raise ValueError(f'{path} is IR version {version}, expected one of {READ_VERSIONS}')
+        self.version = version
+        if version >= 3:
+            trailer_offset, = self._unpack(TRAILER_OFFSET_FMT)
+            self._data_start = self._file.tell()
+            self._data_end: int | None = trailer_offset
+            self._file.seek(trailer_offset)
+            blocks, index = marshal.loads(self._file.read())
+            self._blocks = list(blocks)  # Table blocks not read yet, see iter_load_tables
+            self._strings: list[str] = []
+            self._types: list[tuple] = []
+        else:
+            header_len, = self._unpack(HEADER_LEN_FMT)
+            self._strings, self._types, index = marshal.loads(self._file.read(header_len))
+            self._data_start = self._file.tell()
+            self._data_end = None
+            self._blocks = []
+        self._index: dict[str, tuple[str, int, int]] = {name: (pkg, offset, size) for name, pkg, offset, size in index}
+        self._type_cats = {cat.value: cat for cat in TypeCat}
+        self._type_refs: dict[int, TypeRef] = {}
+
+    def iter_load_tables(self) -> Iterator[None]:
+        """Reads the string and type table blocks left, yielding after each one so opening a big file can be spread
+        over ticks. Loading a class reads the ones left first, the class names and packages don't need them."""
+        while self._blocks:
+            offset, size = self._blocks.pop(0)
+            self._file.seek(self._data_start + offset)
+            strings, types = marshal.loads(self._file.read(size))
+            self._strings.extend(strings)
+            self._types.extend(types)
+            yield
+
+    def tables_left(self) -> int:
+        """Number of table blocks iter_load_tables has still to read."""
+        return len(self._blocks)
+
+    def _load_tables(self) -> None:
+        for _ in self.iter_load_tables():
+            pass
+
+    def _unpack(self, fmt: str) -> tuple:
+        return struct.unpack(fmt, self._file.read(struct.calcsize(fmt)))
+
+    def __enter__(self) -> IRReader:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Closes the file and drops the tables, so a sliced merge frees them when it's done reading rather than in
+        its last step."""
+        self._file.close()
+        self._strings, self._types, self._type_refs = [], [], {}
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def class_names(self, package: str | None = None) -> list[str]:
+        """Full names of the classes in the file, optionally only those of one package. Keeps the written order."""
+        return [name for name, (pkg, _, _) in self._index.items() if package is None or pkg == package]
+
+    def package(self, full_name: str) -> str:
+        return self._index[full_name][0]
+
+    def packages(self) -> list[str]:
+        return list(dict.fromkeys(pkg for pkg, _, _ in self._index.values()))
+
+    def load_class(self, full_name: str) -> ClassDef:
+        if self._blocks:
+            self._load_tables()
+        _, offset, size = self._index[full_name]
+        self._file.seek(self._data_start + offset)
+        return self._class_def(marshal.loads(self._file.read(size)))
+
+    def load_package(self, package: str) -> list[ClassDef]:
+        return [self.load_class(name) for name in self.class_names(package)]
+
+    def load_all(self) -> list[ClassDef]:
+        if self._blocks:
+            self._load_tables()
+        self._file.seek(self._data_start)
+        data = self._file.read(-1 if self._data_end is None else self._data_end - self._data_start)
+        return [self._class_def(marshal.loads(data[offset:offset + size])) for _, offset, size in self._index.values()]
+
+    def _names(self, ids: tuple[int, ...]) -> list[str]:
+        return [self._strings[i] for i in ids]
+
+    def _type_ref(self, idx: int) -> TypeRef:
+        type_ref = self._type_refs.get(idx)
+        if type_ref is None:
+            names, package, type_cat, *_, type_constructors = self._types[idx]  # v1 has a game before constructors
+            type_ref = self._type_refs[idx] = TypeRef(self._names(names), self._strings[package],
+                                                      self._type_cats[type_cat], self._names(type_constructors))
+        return type_ref
+
+    def _base(self, base: tuple) -> tuple[list[str], str, TypeCat]:
+        names, package, type_cat = base
+        return self._names(names), self._strings[package], self._type_cats[type_cat]
+
+    def _class_def(self, record: tuple) -> ClassDef:
+        if self.version == 1:
+            record = record[:1] + record[2:]
+        base, supers, enums, structs, props, funcs = record
+        class_def = ClassDef(*self._base(base))
+        class_def.supers = [self._type_ref(sup) for sup in supers]
+        for enum_base, enum_supers, attributes in enums:
+            class_def.enums.append(EnumDef(*self._base(enum_base), supers=[self._type_ref(sup) for sup in enum_supers],
+                                           attributes={self._strings[name]: value for name, value in attributes}))
+        for struct_base, struct_supers, struct_props in structs:
+            class_def.structs.append(StructDef(*self._base(struct_base),
+                                               supers=[self._type_ref(sup) for sup in struct_supers],
+                                               properties=[PropertyRef(self._strings[name], self._type_ref(type_id))
+                                                           for name, type_id in struct_props]))
+        class_def.properties = [PropertyRef(self._strings[name], self._type_ref(type_id)) for name, type_id in props]
+        for func_base, params, ret in funcs:
+            class_def.functions.append(FunctionDef(*self._base(func_base),
+                                                   params=[ParamRef(self._strings[name], self._type_ref(type_id))
+                                                           for name, type_id in params],
+                                                   ret=None if ret == NO_REF else ReturnRef(self._type_ref(ret))))
+        return class_def
+
+
+def read_ir(path: str) -> list[ClassDef]:
+    with IRReader(path) as reader:
+        return reader.load_all()
+
+
+def iter_merge_into_ir(path: str, class_defs: list[ClassDef],
+                       replace_packages: Iterable[str] = ()) -> Generator[None, None, tuple[int, int, int]]:
+    """Steps of merge_into_ir, yields once per table block read, per class and after closing the existing file so it
+    can be run a few classes per tick. Returns the counts replaced, added and removed. class_defs is only read once the first step runs."""
+    new_defs = {class_def.full_name(): class_def for class_def in class_defs}
+    replace_packages = set(replace_packages)
+    replaced = removed = 0
+    with IRWriter(path) as writer:
+        if os.path.exists(path):
+            # Closed before the writer replaces the file
+            with IRReader(path) as reader:
+                yield from reader.iter_load_tables()
+                for name in reader.class_names():
+                    new_def = new_defs.pop(name, None)
+                    if new_def:
+                        writer.add(new_def)
+                        replaced += 1
+                    elif reader.package(name) in replace_packages:
+                        removed += 1
+                    else:
+                        writer.add(reader.load_class(name))
+                    yield
+            yield  # Dropping the reader's tables
+        for new_def in new_defs.values():
+            writer.add(new_def)
+            yield
+    return replaced, len(new_defs), removed
+
+
+def merge_into_ir(path: str, class_defs: list[ClassDef], replace_packages: Iterable[str] = ()) -> tuple[int, int, int]:
+    """Update an IR file with some re-extracted classes, writing a new one if there's none yet. Classes already in the
+    file are replaced in place and new ones added to the end. Classes of replace_packages that aren't in class_defs
+    are removed, for when whole packages were extracted again. Returns the counts replaced, added and removed."""
+    steps = iter_merge_into_ir(path, class_defs, replace_packages)
+    while True:
+        try:
+            next(steps)
+        except StopIteration as done:
+            return done.value
+
+
+def shard_path(shard_dir: str, package: str) -> str:
+    return f'{shard_dir}/{package}.ir'
+
+
+def read_shard_index(shard_dir: str) -> list[str]:
+    """Packages whose shard has been completely written, in extraction order."""
+    index_path = f'{shard_dir}/{SHARD_INDEX_NAME}'
+    if not os.path.exists(index_path):
+        return []
+    with open(index_path) as f:
+        return json.load(f)['packages']
+
+
+def write_shard_index(shard_dir: str, packages: list[str]) -> None:
+    index_path = f'{shard_dir}/{SHARD_INDEX_NAME}'
+    with open(f'{index_path}.tmp', 'w') as f:
+        json.dump({'packages': packages}, f, indent=1)
+    os.replace(f'{index_path}.tmp', index_path)
+
+
+def iter_combine_shards(shard_dir: str, path: str) -> Iterator[None]:
+    """Steps of combine_shards, yields once per table block read and per class copied so it can be run a few classes
+    per tick."""
+    with IRWriter(path) as writer:
+        for package in read_shard_index(shard_dir):
+            with IRReader(shard_path(shard_dir, package)) as reader:
+                yield from reader.iter_load_tables()
+                for name in reader.class_names():
+                    writer.add(reader.load_class(name))
+                    yield
+
+
+def combine_shards(shard_dir: str, path: str) -> None:
+    """Combine the finished shards into one IR file, loading a single class at a time."""
+    for _ in iter_combine_shards(shard_dir, path):
+        pass
+
+
+LEGACY_DEFS = {cls.__name__: cls for cls in
+               (ClassDef, EnumDef, FunctionDef, ParamRef, PropertyRef, ReturnRef, StructDef, TypeRef)}
+
+
+class _LegacyDef:
+    """Stand-in for a def pickled by older runs, before defs were slotted and games were dropped from them."""
+
+    def __setstate__(self, state: dict) -> None:
+        self.state = state
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    def find_class(self, module: str, name: str):
+        if module.endswith('definitions') and name in LEGACY_DEFS:
+            return type(name, (_LegacyDef,), {})
+        return super().find_class(module, name)
+
+
+def _from_legacy(obj):
+    if isinstance(obj, list):
+        return [_from_legacy(item) for item in obj]
+    if not isinstance(obj, _LegacyDef):
+        return obj
+    state = {name: _from_legacy(value) for name, value in obj.state.items() if name != 'game'}
+    return LEGACY_DEFS[type(obj).__name__](**state)
+
+
+def convert_pickle(pkl_path: str, ir_path: str | None = None) -> str:
+    """Convert a pickled list of ClassDef from older runs to the IR format. Returns the path written."""
+    ir_path = ir_path or f'{os.path.splitext(pkl_path)[0]}.ir'
+    with open(pkl_path, 'rb') as f:
+        class_defs: list[ClassDef] = _from_legacy(_LegacyUnpickler(f).load())
+    write_ir(ir_path, class_defs)
+    return ir_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Class def IR file utilities.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    convert_parser = subparsers.add_parser('convert', help='Convert class def pickles to IR files next to them.')
+    convert_parser.add_argument('pickles', nargs='+')
+    info_parser = subparsers.add_parser('info', help='Show what an IR file contains.')
+    info_parser.add_argument('path')
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        for pkl_path in args.pickles:
+            ir_path = convert_pickle(pkl_path)
+            print(f'{pkl_path} ({os.path.getsize(pkl_path)} bytes) -> {ir_path} ({os.path.getsize(ir_path)} bytes)')
+    else:
+        with IRReader(args.path) as reader:
+            print(f'{args.path}: {len(reader)} classes in {len(reader.packages())} packages, '
+                  f'{os.path.getsize(args.path)} bytes')
+
+register_module(__name__)
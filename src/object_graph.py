@@ -0,0 +1,98 @@
+'''Recording of the raw reflection graph the extraction reads, so get_class_defs can run outside the game.
+
+record_object_graph walks every class and everything reachable from it through the fields game_class_defs reads
+(outers, classes, supers, children, property targets), and writes it as a marshalled list of records:
+    (name, class index, outer index, refs, values, enum values)
+refs maps field names to the index of the object they point at, NO_REF for None. values holds the plain property
+fields (flags and array dim), enum values are name -> value for enums and None for everything else.
+fake_unrealsdk serves a recorded graph through the same attributes as unrealsdk.
+'''
+from __future__ import annotations
+
+import marshal
+import os
+from collections import deque
+from typing import TYPE_CHECKING, Any
+
+from .runner import register_module
+
+if TYPE_CHECKING:
+    from unrealsdk.unreal import UObject
+
+FORMAT_VERSION = 1
+NO_REF = -1
+
+REF_FIELDS = ('SuperField', 'Children', 'Next', 'Inner', 'Struct', 'PropertyClass', 'Enum', 'InterfaceClass',
+              'MetaClass', 'Signature')
+VALUE_FIELDS = ('PropertyFlags', 'ArrayDim')
+
+_MISSING = object()
+
+type ObjectRecord = tuple[str, int, int, dict[str, int], dict[str, Any], dict[str, int] | None]
+
+
+def _get_field(obj: UObject, field: str) -> Any:
+    try:
+        return getattr(obj, field)
+    except Exception:  # Field doesn't exist on this type of object
+        return _MISSING
+
+
+def record_object_graph(path: str) -> int:
+    """Record every class and the objects reachable from it to path. Needs the game, returns the object count."""
+    from unrealsdk import find_all
+    from .game_class_defs import get_enum_values
+
+    indices: dict[int, int] = {}
+    objects: list[UObject] = []
+    queue: deque[UObject] = deque()
+
+    def index_of(obj: UObject | None) -> int:
+        if obj is None:
+            return NO_REF
+        address = obj._get_address()
+        idx = indices.get(address)
+        if idx is None:
+            idx = indices[address] = len(objects)
+            objects.append(obj)
+            queue.append(obj)
+        return idx
+
+    for cls in find_all('Class'):
+        index_of(cls)
+
+    records: list[ObjectRecord] = []
+    while queue:
+        obj = queue.popleft()
+        refs = {}
+        for field in REF_FIELDS:
+            value = _get_field(obj, field)
+            if value is not _MISSING:
+                refs[field] = index_of(value)
+        values = {}
+        for field in VALUE_FIELDS:
+            value = _get_field(obj, field)
+            if value is not _MISSING:
+                values[field] = value
+        enum_values = get_enum_values(obj) if obj.Class.Name == 'Enum' else None
+        records.append((obj.Name, index_of(obj.Class), index_of(obj.Outer), refs, values, enum_values))
+
+    write_object_graph(path, records)
+    return len(records)
+
+
+def write_object_graph(path: str, records: list[ObjectRecord]) -> None:
+    with open(f'{path}.tmp', 'wb') as f:
+        marshal.dump((FORMAT_VERSION, records), f)
+    os.replace(f'{path}.tmp', path)
+
+
+def read_object_graph(path: str) -> list[ObjectRecord]:
+    with open(path, 'rb') as f:
+        version, records = marshal.load(f)
+    if version != FORMAT_VERSION:
+        raise ValueError(f'{path} is object graph version {version}, expected {FORMAT_VERSION}')
+    return records
+
+
+register_module(__name__)
@@ -0,0 +1,197 @@
+'''
+Runs the offline steps as a chain of cached stages instead of running each script by hand:
+    extract -> merge -> render
+extract is done in game with bps, here it only checks the game IR files are there. merge writes
+common_class_defs.ir, render writes the stubs (and optionally the zip).
+
+Each stage has a key: the content hashes of its input files, a fingerprint of the code it runs and its options. When
+the key and the hashes of its outputs match the last run, the stage is skipped. The code fingerprint of merge only
+covers the def fields and how defs compare, so changing a renderer or DEFAULT_IMPORTS re-renders without re-merging.
+File hashes are cached by size and mtime in the state file, so a rebuild with nothing to do doesn't read the IR.
+
+    python -m src.pipeline              run whatever is out of date
+    python -m src.pipeline -s render    only the render stage, if it's out of date
+    python -m src.pipeline -f           run every stage
+'''
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import hashlib
+import inspect
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from . import common_class_defs, definitions, game, ir_file, write_stubs
+from .definitions import ClassDef, EnumDef, FunctionDef, ParamRef, PropertyRef, ReturnRef, StructDef, TypeRef
+from .paths import BL2_DIR, CLASS_DEF_DATA_DIR, COMMON_DIR, PYSTUBS_DIR, TPS_DIR
+from .runner import register_module
+from .write_stubs import MANIFEST_DIR, stub_manifest_path
+
+STATE_NAME = '.pipeline_state.json'
+STAGES = ('extract', 'merge', 'render')
+
+
+class FileHasher:
+    """sha256 of files, cached by path, size and mtime so unchanged files aren't read again."""
+
+    def __init__(self, cache: dict[str, list] | None = None):
+        self.cache: dict[str, list] = cache or {}
+
+    def hash(self, path: str) -> str | None:
+        """None if the file doesn't exist."""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        cached = self.cache.get(path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        self.cache[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return self.cache[path][2]
+
+
+def code_fingerprint(*objs: Any) -> str:
+    """Hash of the source of modules, classes or functions. Strings are hashed as they are."""
+    digest = hashlib.sha256()
+    for obj in objs:
+        digest.update((obj if isinstance(obj, str) else inspect.getsource(obj)).encode())
+    return digest.hexdigest()
+
+
+def def_schema() -> str:
+    """What merging depends on in definitions: the def fields and how defs are compared, no renderers."""
+    parts = [repr([(cat.name, cat.value) for cat in definitions.TypeCat])]
+    for cls in (ClassDef, EnumDef, FunctionDef, ParamRef, PropertyRef, ReturnRef, StructDef):
+        parts.append(repr([(f.name, str(f.type)) for f in dataclasses.fields(cls)]))
+        if 'key' in vars(cls):
+            parts.append(inspect.getsource(cls.key))
+    parts.extend(inspect.getsource(func) for func in (TypeRef.__new__, TypeRef.__eq__, TypeRef.key))
+    return '\n'.join(parts)
+
+
+@dataclass
+class Stage:
+    '''
+    One step of the pipeline. run is None for stages that can't be run from here, those only check their outputs
+    exist. Stages run in list order, later stages take earlier ones' outputs as inputs.
+    '''
+    name: str
+    inputs: list[str]
+    outputs: list[str]
+    run: Callable[[], Any] | None = None
+    code: str = ''
+    options: dict[str, Any] = field(default_factory=dict)
+
+    def key(self, hasher: FileHasher) -> str:
+        return hashlib.sha256(json.dumps({
+            'inputs': {path: hasher.hash(path) for path in self.inputs},
+            'code': self.code,
+            'options': self.options,
+        }, sort_keys=True).encode()).hexdigest()
+
+
+def get_stages(workers: int = 1, delta: bool = False, compact: bool = False, sort_exports: bool = False,
+               zip_path: str | None = None) -> list[Stage]:
+    game_irs = [f'{CLASS_DEF_DATA_DIR}/BL2_class_defs.ir', f'{CLASS_DEF_DATA_DIR}/TPS_class_defs.ir']
+    common_ir = f'{CLASS_DEF_DATA_DIR}/common_class_defs.ir'
+
+    def merge() -> None:
+        bl2_class_defs, tps_class_defs = (ir_file.read_ir(path) for path in game_irs)
+        ir_file.write_ir(common_ir, common_class_defs.create_common_class_defs(bl2_class_defs, tps_class_defs))
+
+    def render() -> None:
+        reports = write_stubs.write_game_stubs(workers, True, sort_exports, delta=delta, compact=compact,
+                                               zip_path=zip_path)
+        for base_dir, report in reports.items():
+            print(f'\t{base_dir}: {report}')
+
+    # The manifests have the hash of every stub file, so they stand in for the whole tree
+    render_outputs = [stub_manifest_path(MANIFEST_DIR, base_dir) for base_dir in (COMMON_DIR, TPS_DIR, BL2_DIR)]
+    render_outputs.append(f'{PYSTUBS_DIR}/type_defs.pyi')
+    if zip_path:
+        render_outputs.append(zip_path)
+
+    return [
+        Stage('extract', [], game_irs),
+        Stage('merge', game_irs, [common_ir], merge, code_fingerprint(common_class_defs, ir_file, def_schema())),
+        Stage('render', [*game_irs, common_ir], render_outputs, render,
+              code_fingerprint(definitions, write_stubs, game, ir_file),
+              {'delta': delta, 'compact': compact, 'sort_exports': sort_exports, 'zip': zip_path,
+               'out_dirs': [COMMON_DIR, TPS_DIR, BL2_DIR]}),
+    ]
+
+
+class Pipeline:
+    """Runs stages and keeps their keys, output hashes and the file hash cache in a state file."""
+
+    def __init__(self, state_path: str = f'{CLASS_DEF_DATA_DIR}/{STATE_NAME}'):
+        self.state_path = state_path
+        state = {}
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                state = json.load(f)
+        self.stages: dict[str, dict] = state.get('stages', {})
+        self.hasher = FileHasher(state.get('files'))
+
+    def save(self) -> None:
+        with open(f'{self.state_path}.tmp', 'w') as f:
+            json.dump({'stages': self.stages, 'files': self.hasher.cache}, f, indent=1, sort_keys=True)
+        os.replace(f'{self.state_path}.tmp', self.state_path)
+
+    def up_to_date(self, stage: Stage, key: str) -> bool:
+        last = self.stages.get(stage.name)
+        return bool(last) and last['key'] == key and \
+            all(self.hasher.hash(path) == last['outputs'].get(path) for path in stage.outputs)
+
+    def run(self, stages: list[Stage], only: str | None = None, force: bool = False) -> list[str]:
+        """Run the out of date stages, or only the one named. Returns the names of the stages that ran."""
+        ran = []
+        for stage in stages:
+            if only and stage.name != only:
+                continue
+            if stage.run is None:
+                missing = [path for path in stage.outputs if self.hasher.hash(path) is None]
+                if missing:
+                    raise FileNotFoundError(f'{stage.name}: {", ".join(missing)} missing, run bps in game first')
+                continue
+
+            key = stage.key(self.hasher)
+            if not force and self.up_to_date(stage, key):
+                print(f'{stage.name}: up to date')
+                continue
+
+            start = time.perf_counter()
+            stage.run()
+            self.stages[stage.name] = {'key': key, 'outputs': {path: self.hasher.hash(path) for path in stage.outputs}}
+            self.save()  # After every stage, so a failure later on doesn't redo the finished ones
+            ran.append(stage.name)
+            print(f'{stage.name}: ran in {time.perf_counter() - start:.2f}s')
+        self.save()
+        return ran
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the out of date offline stages: merge and render.')
+    parser.add_argument('-s', '--stage', choices=STAGES, help='Only run this stage.')
+    parser.add_argument('-f', '--force', action='store_true', help='Run stages even when they are up to date.')
+    parser.add_argument('-j', '--workers', type=int, default=1, help='Render processes, 0 uses every core.')
+    parser.add_argument('-d', '--delta', action='store_true', help='Render game stubs as inheritance deltas.')
+    parser.add_argument('-c', '--compact', action='store_true', help='Render functions compactly.')
+    parser.add_argument('--sort-exports', action='store_true', help='Sort package exports by name.')
+    parser.add_argument('-z', '--zip', help='Also write the stubs to this zip.')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    Pipeline().run(get_stages(args.workers or os.cpu_count() or 1, args.delta, args.compact, args.sort_exports,
+                              args.zip), args.stage, args.force)
+    print(f'Done in {time.perf_counter() - start:.2f}s')
+
+register_module(__name__)
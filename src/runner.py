@@ -2,7 +2,7 @@
 import argparse
 import copy
 import importlib
-import pickle
+import os
 import sys
 from collections import defaultdict
 
@@ -19,24 +19,115 @@ try:
     @command
     def bps(args: argparse.Namespace) -> None:
         """Utility to automatically reload modules in the correct order. Requires that they all implement register_module"""
-        from .game_class_defs import get_class_defs
+        from .game_class_defs import check_enum_values, clear_caches, extract_class_defs_sharded, filter_classes, \
+            get_class_defs, get_classes_by_package, iter_class_defs, iter_sharded_extraction, prepare_shard_dir
+        from .ir_file import IRReader, iter_merge_into_ir, iter_write_ir, merge_into_ir, write_ir
         from .paths import CLASS_DEF_DATA_DIR
+        from .sliced_task import SlicedTask
+        from unrealsdk import find_all
 
-        module = 'src'
-        import_order_copy = copy.copy(import_order[module])
-        import_order[module] = []
-        for module_name in import_order_copy:
-            module = sys.modules.get(module_name)
-            if module:
-                importlib.reload(module)
-                print(f'Reloaded module {module_name}')
+        filtered = bool(args.package or args.class_glob or args.subclass_of)
+        if filtered and (args.stream or args.record or args.check_enums):
+            print('--package, --class and --subclass-of only work with a normal or --sliced extraction')
+            return
 
+        if not args.no_reload:
+            module = 'src'
+            import_order_copy = copy.copy(import_order[module])
+            import_order[module] = []
+            for module_name in import_order_copy:
+                module = sys.modules.get(module_name)
+                if module:
+                    importlib.reload(module)
+                    print(f'Reloaded module {module_name}')
+
+
+        if args.check_enums:
+            check_enum_values()
+            return
+
+        from .definitions import OUTER_CHAIN_CACHE  # After reloading, so we get the cache from_uobject uses
+        clear_caches()
+        log_cache_stats = lambda: print(OUTER_CHAIN_CACHE.stats_str())
 
-        class_defs = get_class_defs()
         game_str = mods_base_Game.get_current().name
+        if args.record:
+            from .object_graph import record_object_graph
+            graph_path = f'{CLASS_DEF_DATA_DIR}/{game_str}_object_graph.bin'
+            print(f'Recorded {record_object_graph(graph_path)} objects to {graph_path}')
+            return
+
+        out_path = f'{CLASS_DEF_DATA_DIR}/{game_str}_class_defs.ir'
+        shard_dir = f'{CLASS_DEF_DATA_DIR}/{game_str}_shards'
+        if filtered:
+            # Only the matching classes, merged into the existing dump. With only packages given they were extracted
+            # in full, so classes that are gone from them are dropped from the dump too.
+            classes = filter_classes(find_all('Class'), args.package or (), args.class_glob or (), args.subclass_of or ())
+            replace_packages = args.package if not (args.class_glob or args.subclass_of) else ()
+            print(f'Extracting {len(classes)} classes')
+
+            def report(replaced: int, added: int, removed: int) -> None:
+                print(f'{out_path}: {replaced} replaced, {added} added, {removed} removed')
+                log_cache_stats()
+
+            if args.sliced:
+                def steps():
+                    class_defs = []
+                    for class_def in iter_class_defs(classes):
+                        class_defs.append(class_def)
+                        yield
+                    report(*(yield from iter_merge_into_ir(out_path, class_defs, replace_packages)))
+
+                # Extracting, then reading the current dump's table blocks, merging its classes and the new ones and
+                # closing it
+                total = len(classes)
+                if os.path.exists(out_path):
+                    with IRReader(out_path) as reader:
+                        total += reader.tables_left() + len(reader) + 1
+                SlicedTask('bps', steps(), total, budget_ms=args.budget_ms).start()
+            else:
+                report(*merge_into_ir(out_path, list(iter_class_defs(classes)), replace_packages))
+        elif args.sliced:
+            # Same extraction as below, but run from the tick hook a few classes at a time
+            if args.stream:
+                finished = prepare_shard_dir(shard_dir, args.restart)
+                packages = get_classes_by_package()
+                # Extracting the unfinished packages, then copying every package's classes into the combined file.
+                # Reading each shard's table blocks adds a step per block, not counted as the shards don't exist yet
+                total = sum(len(classes) for pkg, classes in packages.items() if pkg not in finished) + \
+                    sum(len(classes) for classes in packages.values())
+                task = SlicedTask('bps', iter_sharded_extraction(shard_dir, out_path, packages), total,
+                                  log_cache_stats, args.budget_ms)
+            else:
+                # Each class is written as it's extracted, so finishing only writes the IR file's trailer
+                classes = list(find_all('Class'))
+                task = SlicedTask('bps', iter_write_ir(out_path, iter_class_defs(classes)), len(classes),
+                                  log_cache_stats, args.budget_ms)
+            task.start()
+        elif args.stream:
+            extract_class_defs_sharded(shard_dir, out_path, args.restart)
+            log_cache_stats()
+        else:
+            write_ir(out_path, get_class_defs())
+            log_cache_stats()
 
-        with open(f'{CLASS_DEF_DATA_DIR}/{game_str}_class_defs.pkl', 'wb') as f:
-            pickle.dump(class_defs, f)
+    bps.add_argument('--stream', action='store_true',
+                     help='Write each package to its own shard as it is extracted and resume unfinished runs.')
+    bps.add_argument('--restart', action='store_true', help='With --stream, discard shards from an unfinished run.')
+    bps.add_argument('--check-enums', action='store_true',
+                     help='Compare bulk and per call enum value extraction on every enum instead of extracting.')
+    bps.add_argument('--sliced', action='store_true',
+                     help='Extract a few classes per game tick in the background instead of blocking the game.')
+    bps.add_argument('--budget-ms', type=float, default=8.0, help='With --sliced, time to spend extracting per tick.')
+    bps.add_argument('--record', action='store_true',
+                     help='Record the reflection object graph for offline runs with fake_unrealsdk instead of extracting.')
+    bps.add_argument('--package', action='append',
+                     help='Only extract classes of this package and merge them into the existing dump. Repeatable.')
+    bps.add_argument('--class', dest='class_glob', action='append',
+                     help='Only extract classes with a name matching this glob, like Willow*Pawn. Repeatable.')
+    bps.add_argument('--subclass-of', action='append',
+                     help='Only extract this class and its subclasses, by name. Repeatable.')
+    bps.add_argument('--no-reload', action='store_true', help="Don't reload the project's modules first.")
 
 
 except ImportError:
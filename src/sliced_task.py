@@ -0,0 +1,74 @@
+import time
+from typing import Any, Callable, Iterator
+
+from unrealsdk.hooks import Type, add_hook, has_hook, remove_hook
+from unrealsdk.logging import error, info
+
+from .runner import register_module
+
+TICK_FUNC = 'WillowGame.WillowGameViewportClient:Tick'
+HOOK_ID = 'bl_py_stubs.sliced_task'
+
+
+class SlicedTask:
+    '''
+    Runs a long job a few steps per game tick instead of blocking the game thread until it's done.
+    Each tick pulls steps from the iterator until budget_ms has passed. Progress, throughput and ETA are logged every
+    log_interval seconds, and on_done is called once the iterator is exhausted.
+    '''
+
+    def __init__(self, name: str, steps: Iterator[Any], total: int, on_done: Callable[[], None] | None = None,
+                 budget_ms: float = 8.0, log_interval: float = 2.0):
+        self.name = name
+        self.steps = steps
+        self.total = total
+        self.on_done = on_done
+        self.budget = budget_ms / 1000
+        self.log_interval = log_interval
+        self.done = 0
+        self._start = 0.0
+        self._last_log = 0.0
+
+    @staticmethod
+    def is_running() -> bool:
+        return has_hook(TICK_FUNC, Type.PRE, HOOK_ID)
+
+    def start(self) -> None:
+        if self.is_running():
+            raise RuntimeError('A sliced task is already running')
+        self._start = self._last_log = time.perf_counter()
+        add_hook(TICK_FUNC, Type.PRE, HOOK_ID, self._on_tick)
+        info(f'{self.name}: started, {self.total} steps with {self.budget * 1000:.1f}ms per tick')
+
+    def stop(self) -> None:
+        remove_hook(TICK_FUNC, Type.PRE, HOOK_ID)
+
+    def progress_str(self) -> str:
+        elapsed = time.perf_counter() - self._start
+        rate = self.done / elapsed if elapsed else 0
+        eta = (self.total - self.done) / rate if rate else 0
+        return f'{self.done}/{self.total} ({rate:.0f}/sec, ETA {eta:.0f}s)'
+
+    def _on_tick(self, *args: Any) -> None:
+        tick_start = time.perf_counter()
+        try:
+            while time.perf_counter() - tick_start < self.budget:
+                next(self.steps)
+                self.done += 1
+        except StopIteration:
+            self.stop()
+            info(f'{self.name}: finished {self.done} steps in {time.perf_counter() - self._start:.1f}s')
+            if self.on_done:
+                self.on_done()
+            return
+        except Exception as e:
+            self.stop()
+            error(f'{self.name}: stopped after {self.done} steps, {type(e).__name__}: {e}')
+            raise
+
+        if tick_start - self._last_log >= self.log_interval:
+            self._last_log = tick_start
+            info(f'{self.name}: {self.progress_str()}')
+
+
+register_module(__name__)
@@ -0,0 +1,277 @@
+'''
+SQLite index of the class defs, so questions like "which classes define function X" or "what differs between BL2
+and TPS for class Z" don't need grepping the stubs. Built from the IR by write_stubs --index, one row set per
+namespace (common, bl2, tps). Types are stored by full name (Engine.Actor, Core.Object.Vector, or int for builtins)
+with their type constructors (list, Out, Optional, tuple_N, ...) comma separated.
+
+Names are also in an FTS5 table with the trigram tokenizer, so find matches any part of a name, like Controller in
+WillowPlayerController. That covers classes, structs, enums, properties, struct fields and function params. Without
+FTS5 in the sqlite build find falls back to LIKE.
+
+    python -m src.symbol_index symbols.db find Controller
+    python -m src.symbol_index symbols.db functions ClientSetHUD
+    python -m src.symbol_index symbols.db fields-of-type Core.Object.Vector
+    python -m src.symbol_index symbols.db diff WillowGame.WillowPlayerController
+'''
+from __future__ import annotations
+
+import argparse
+import os
+import sqlite3
+import time
+
+from .definitions import ClassDef, TypeCat, TypeRef
+from .game import Game
+from .runner import register_module
+
+SCHEMA = '''
+CREATE TABLE classes (id INTEGER PRIMARY KEY, game TEXT, package TEXT, name TEXT, full_name TEXT);
+CREATE TABLE supers (class_id INTEGER, position INTEGER, super TEXT);
+CREATE TABLE structs (id INTEGER PRIMARY KEY, class_id INTEGER, name TEXT, full_name TEXT, super TEXT);
+CREATE TABLE enums (id INTEGER PRIMARY KEY, class_id INTEGER, name TEXT, full_name TEXT);
+CREATE TABLE enum_values (enum_id INTEGER, name TEXT, value INTEGER);
+CREATE TABLE properties (class_id INTEGER, struct_id INTEGER, name TEXT, type TEXT, type_cat TEXT, constructors TEXT);
+CREATE TABLE functions (id INTEGER PRIMARY KEY, class_id INTEGER, name TEXT, ret TEXT, ret_constructors TEXT);
+CREATE TABLE params (function_id INTEGER, position INTEGER, name TEXT, type TEXT, type_cat TEXT, constructors TEXT);
+'''
+
+# Created after the rows are in, building them once is faster than updating them on every insert
+INDEXES = '''
+CREATE INDEX classes_full_name ON classes (full_name, game);
+CREATE INDEX classes_name ON classes (name);
+CREATE INDEX supers_class ON supers (class_id);
+CREATE INDEX supers_super ON supers (super);
+CREATE INDEX structs_class ON structs (class_id);
+CREATE INDEX structs_full_name ON structs (full_name);
+CREATE INDEX enums_class ON enums (class_id);
+CREATE INDEX enum_values_enum ON enum_values (enum_id);
+CREATE INDEX properties_class ON properties (class_id);
+CREATE INDEX properties_struct ON properties (struct_id);
+CREATE INDEX properties_type ON properties (type);
+CREATE INDEX functions_class ON functions (class_id);
+CREATE INDEX functions_name ON functions (name);
+CREATE INDEX params_function ON params (function_id);
+CREATE INDEX params_type ON params (type);
+'''
+
+FTS_SCHEMA = "CREATE VIRTUAL TABLE symbols USING fts5(name, full_name, kind, game, tokenize='trigram')"
+
+
+def _type_name(type_ref: TypeRef) -> str:
+    return '.'.join(type_ref.names) if type_ref.type_cat in [TypeCat.BUILTIN, TypeCat.CONST] else type_ref.full_name()
+
+
+def _type_cols(type_ref: TypeRef) -> tuple[str, str, str]:
+    return _type_name(type_ref), type_ref.type_cat.name, ','.join(type_ref.type_constructors)
+
+
+class SymbolIndexWriter:
+    """Fills a new database one class at a time. Written to a temp path and moved into place on close."""
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.exists(f'{path}.tmp'):
+            os.remove(f'{path}.tmp')
+        self.conn = sqlite3.connect(f'{path}.tmp')
+        self.conn.executescript(SCHEMA)
+        try:
+            self.conn.execute(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:  # sqlite built without FTS5 or trigram
+            self.fts = False
+        self._symbols: list[tuple[str, str, str, str]] = []
+
+    def __enter__(self) -> SymbolIndexWriter:
+        return self
+
+    def __exit__(self, exc_type, *args) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.conn.close()
+
+    def add(self, game: Game, class_def: ClassDef) -> None:
+        cur = self.conn.cursor()
+        cur.execute('INSERT INTO classes (game, package, name, full_name) VALUES (?, ?, ?, ?)',
+                    (game.value, class_def.package, class_def.name(), class_def.full_name()))
+        class_id = cur.lastrowid
+        self._symbols.append((class_def.name(), class_def.full_name(), 'class', game.value))
+        cur.executemany('INSERT INTO supers VALUES (?, ?, ?)',
+                        [(class_id, i, sup.full_name()) for i, sup in enumerate(class_def.supers)])
+
+        for struct in class_def.structs:
+            cur.execute('INSERT INTO structs (class_id, name, full_name, super) VALUES (?, ?, ?, ?)',
+                        (class_id, struct.name(), struct.full_name(),
+                         struct.supers[0].full_name() if struct.supers else None))
+            cur.executemany('INSERT INTO properties VALUES (?, ?, ?, ?, ?, ?)',
+                            [(class_id, cur.lastrowid, prop.var_name, *_type_cols(prop.type_ref))
+                             for prop in struct.properties])
+            self._symbols.append((struct.name(), struct.full_name(), 'struct', game.value))
+            self._symbols.extend((prop.var_name, f'{struct.full_name()}.{prop.var_name}', 'field', game.value)
+                                 for prop in struct.properties)
+
+        for enum in class_def.enums:
+            cur.execute('INSERT INTO enums (class_id, name, full_name) VALUES (?, ?, ?)',
+                        (class_id, enum.name(), enum.full_name()))
+            cur.executemany('INSERT INTO enum_values VALUES (?, ?, ?)',
+                            [(cur.lastrowid, name, value) for name, value in enum.attributes.items()])
+            self._symbols.append((enum.name(), enum.full_name(), 'enum', game.value))
+
+        cur.executemany('INSERT INTO properties VALUES (?, NULL, ?, ?, ?, ?)',
+                        [(class_id, prop.var_name, *_type_cols(prop.type_ref)) for prop in class_def.properties])
+        self._symbols.extend((prop.var_name, f'{class_def.full_name()}.{prop.var_name}', 'property', game.value)
+                             for prop in class_def.properties)
+
+        for func in class_def.functions:
+            ret_name, _, ret_constructors = _type_cols(func.ret.type_ref) if func.ret else (None, None, None)
+            cur.execute('INSERT INTO functions (class_id, name, ret, ret_constructors) VALUES (?, ?, ?, ?)',
+                        (class_id, func.name(), ret_name, ret_constructors))
+            cur.executemany('INSERT INTO params VALUES (?, ?, ?, ?, ?, ?)',
+                            [(cur.lastrowid, i, param.var_name, *_type_cols(param.type_ref))
+                             for i, param in enumerate(func.params)])
+            self._symbols.append((func.name(), func.full_name(), 'function', game.value))
+            self._symbols.extend((param.var_name, f'{func.full_name()}.{param.var_name}', 'param', game.value)
+                                 for param in func.params)
+
+    def close(self) -> None:
+        if self.fts:
+            self.conn.executemany('INSERT INTO symbols VALUES (?, ?, ?, ?)', self._symbols)
+        self.conn.executescript(INDEXES)
+        self.conn.execute('ANALYZE')
+        self.conn.commit()
+        self.conn.close()
+        os.replace(f'{self.path}.tmp', self.path)
+
+
+def write_symbol_index(path: str, namespaces: dict[Game, list[ClassDef]]) -> None:
+    with SymbolIndexWriter(path) as writer:
+        for game, class_defs in namespaces.items():
+            for class_def in class_defs:
+                writer.add(game, class_def)
+
+
+def _type_sql(alias: str, type_col: str = 'type', constructors_col: str = 'constructors') -> str:
+    """SQL for a type with its constructors, like Core.Object.Vector[list,Out]."""
+    constructors = f'{alias}.{constructors_col}'
+    return f"{alias}.{type_col} || CASE WHEN {constructors} != '' THEN '[' || {constructors} || ']' ELSE '' END"
+
+
+class SymbolIndex:
+    """Read side, the queries behind the CLI. Every query returns plain rows."""
+
+    def __init__(self, path: str):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        self.conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        self.fts = self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'symbols'").fetchone() is not None
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def find(self, text: str, game: str | None = None, limit: int = 50) -> list[tuple]:
+        """(kind, game, full_name) of symbols with text in their name. The text is matched literally."""
+        if self.fts and len(text) >= 3:  # Trigrams can't match less than 3 characters
+            query = 'SELECT kind, game, full_name FROM symbols WHERE name MATCH ?'
+            # A quoted FTS5 string, where a quote is written twice
+            args: list = ['"' + text.replace('"', '""') + '"']
+        else:
+            query = '''SELECT 'class', game, full_name FROM classes WHERE name LIKE ?1 ESCAPE '!'
+                       UNION ALL SELECT 'struct', c.game, s.full_name FROM structs s JOIN classes c ON s.class_id = c.id
+                           WHERE s.name LIKE ?1 ESCAPE '!'
+                       UNION ALL SELECT 'enum', c.game, e.full_name FROM enums e JOIN classes c ON e.class_id = c.id
+                           WHERE e.name LIKE ?1 ESCAPE '!'
+                       UNION ALL SELECT 'function', c.game, c.full_name || '.' || f.name FROM functions f
+                           JOIN classes c ON f.class_id = c.id WHERE f.name LIKE ?1 ESCAPE '!'
+                       UNION ALL SELECT 'property', c.game, c.full_name || '.' || p.name FROM properties p
+                           JOIN classes c ON p.class_id = c.id WHERE p.struct_id IS NULL AND p.name LIKE ?1 ESCAPE '!'
+                       UNION ALL SELECT 'field', c.game, s.full_name || '.' || p.name FROM properties p
+                           JOIN structs s ON p.struct_id = s.id JOIN classes c ON p.class_id = c.id
+                           WHERE p.name LIKE ?1 ESCAPE '!'
+                       UNION ALL SELECT 'param', c.game, c.full_name || '.' || f.name || '.' || p.name FROM params p
+                           JOIN functions f ON p.function_id = f.id JOIN classes c ON f.class_id = c.id
+                           WHERE p.name LIKE ?1 ESCAPE '!' '''
+            # LIKE's wildcards, _ is all over UE names
+            escaped = text.replace('!', '!!').replace('%', '!%').replace('_', '!_')
+            args = [f'%{escaped}%']
+        if game:
+            query = f'SELECT * FROM ({query}) WHERE game = ?'
+            args.append(game)
+        return self.conn.execute(f'{query} LIMIT {int(limit)}', args).fetchall()
+
+    def functions(self, name: str, game: str | None = None) -> list[tuple]:
+        """(game, class full name, params, return) of every class defining a function called name."""
+        return self.conn.execute(f'''
+            SELECT c.game, c.full_name,
+                   (SELECT group_concat(p.name || ': ' || {_type_sql('p')}, ', ') FROM
+                       (SELECT * FROM params WHERE function_id = f.id ORDER BY position) p),
+                   {_type_sql('f', 'ret', 'ret_constructors')}
+            FROM functions f JOIN classes c ON f.class_id = c.id
+            WHERE f.name = ? AND (?2 IS NULL OR c.game = ?2)
+            ORDER BY c.game, c.full_name''', (name, game)).fetchall()
+
+    def fields_of_type(self, type_name: str, game: str | None = None) -> list[tuple]:
+        """(game, struct or class full name, field) of fields whose type is type_name, structs first."""
+        return self.conn.execute('''
+            SELECT c.game, COALESCE(s.full_name, c.full_name), p.name
+            FROM properties p JOIN classes c ON p.class_id = c.id LEFT JOIN structs s ON p.struct_id = s.id
+            WHERE p.type = ? AND (?2 IS NULL OR c.game = ?2)
+            ORDER BY p.struct_id IS NULL, c.game, 2''', (type_name, game)).fetchall()
+
+    def _members(self, full_name: str, game: str) -> set[tuple]:
+        row = self.conn.execute('SELECT id FROM classes WHERE full_name = ? AND game = ?', (full_name, game)).fetchone()
+        if row is None:
+            return set()
+        return set(self.conn.execute(f'''
+            SELECT 'property', p.name, {_type_sql('p')} FROM properties p WHERE p.class_id = ?1 AND p.struct_id IS NULL
+            UNION ALL
+            SELECT 'function', f.name, '(' || COALESCE((SELECT group_concat(p.name || ': ' || {_type_sql('p')}, ', ')
+                    FROM (SELECT * FROM params WHERE function_id = f.id ORDER BY position) p), '') || ') -> ' ||
+                    COALESCE({_type_sql('f', 'ret', 'ret_constructors')}, 'None')
+                FROM functions f WHERE f.class_id = ?1
+            UNION ALL
+            SELECT 'struct', s.name, s.super FROM structs s WHERE s.class_id = ?1
+            UNION ALL
+            SELECT 'enum', e.name, (SELECT group_concat(v.name || '=' || v.value, ', ')
+                    FROM (SELECT * FROM enum_values WHERE enum_id = e.id ORDER BY value, name) v)
+                FROM enums e WHERE e.class_id = ?1''', row))
+
+    def diff(self, full_name: str, game_a: str = Game.BL2.value, game_b: str = Game.TPS.value) -> list[tuple]:
+        """(game, kind, name, detail) of the members of a class that only one of the games has, or that differ."""
+        a, b = self._members(full_name, game_a), self._members(full_name, game_b)
+        return sorted([(game_a, *row) for row in a - b] + [(game_b, *row) for row in b - a],
+                      key=lambda row: (row[1], row[2], row[0]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query the symbol index written by write_stubs --index.')
+    parser.add_argument('db')
+    parser.add_argument('-g', '--game', choices=[game.value for game in Game], help='Only this namespace.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('find', help='Classes, structs, enums, properties, struct fields and function params with '
+                                       'this text in their name.').add_argument('text')
+    subparsers.add_parser('functions', help='Classes defining a function with this name.').add_argument('name')
+    subparsers.add_parser('fields-of-type', help='Struct and class fields of this type, by full name like '
+                                                 'Core.Object.Vector.').add_argument('type')
+    diff_parser = subparsers.add_parser('diff', help='What differs between two games for a class, by full name.')
+    diff_parser.add_argument('full_name')
+    diff_parser.add_argument('games', nargs='*', default=[Game.BL2.value, Game.TPS.value])
+    args = parser.parse_args()
+
+    index = SymbolIndex(args.db)
+    start = time.perf_counter()
+    if args.command == 'find':
+        rows = index.find(args.text, args.game)
+    elif args.command == 'functions':
+        rows = index.functions(args.name, args.game)
+    elif args.command == 'fields-of-type':
+        rows = index.fields_of_type(args.type, args.game)
+    else:
+        rows = index.diff(args.full_name, *args.games)
+    elapsed = time.perf_counter() - start
+    index.close()
+
+    for row in rows:
+        print('\t'.join('' if col is None else str(col) for col in row))
+    print(f'{len(rows)} rows in {elapsed * 1000:.1f}ms')
+
+register_module(__name__)
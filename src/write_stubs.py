@@ -1,26 +1,269 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
 import os
-import pickle
 import shutil
+import struct
 import textwrap
+import zipfile
+import zlib
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import BinaryIO
 
-from .definitions import  ClassDef
+from .check_stubs import check_stub_tree
+from .common_class_defs import create_common_class_defs
+from .definitions import TYPE_STR_CACHE, ClassDef, Context, NameResolver
+from .game import Game
+from .ir_file import read_ir
 from .paths import BL2_DIR, CLASS_DEF_DATA_DIR, COMMON_DIR, PYSTUBS_DIR, \
     TPS_DIR, get_pkg_dir, \
     get_pkg_init
+from .symbol_index import write_symbol_index
+
+
+TYPE_DEFS = textwrap.dedent(
+    '''\
+    from typing import Generic, TypeVar
+
+    # Create a generic Out type to indicate out parameters
+    T = TypeVar('T')
+
+
+    class OutParam(Generic[T]):
+        """
+        Indicates that a parameter is an 'out' parameter.
+        """
+
+
+    class AttributeProperty(Generic[T]):
+        """
+        Indicates that the property is an attribute property.
+        """
+    '''
+)
+
+CHUNK_SIZE = 200  # Classes per render job. Splits up the big packages (WillowGame, Engine) so they don't serialize the pool.
+# Content hashes of the written stub files of each namespace, for incremental writes. Kept out of the stub tree so
+# they don't ship with it.
+MANIFEST_DIR = f'{CLASS_DEF_DATA_DIR}/stub_manifests'
+
+# Contexts of the namespaces being written, by base dir. Set once per worker process so the resolver isn't pickled
+# along with every job.
+_worker_contexts: dict[str, Context] = {}
+
+
+@dataclass
+class WriteReport:
+    added: int = 0
+    changed: int = 0
+    deleted: int = 0
+    skipped: int = 0
+    # Inheritance delta mode, package -> [bytes, symbols] left out because they're the same as common
+    saved: dict[str, list[int]] = field(default_factory=dict)
+
+    def __str__(self) -> str:
+        report = f'{self.added} added, {self.changed} changed, {self.deleted} deleted, {self.skipped} skipped'
+        if self.saved:
+            report += f', delta saved {sum(b for b, _ in self.saved.values())} bytes ' \
+                      f'and {sum(s for _, s in self.saved.values())} symbols'
+        return report
+
+    def add_saved(self, package: str, skipped: list[str]) -> None:
+        saved = self.saved.setdefault(package, [0, 0])
+        saved[0] += sum(len(text.encode()) for text in skipped)
+        saved[1] += len(skipped)
+
+    def saved_str(self) -> str:
+        return '\n'.join(f'\t{pkg}: {saved_bytes} bytes, {symbols} symbols'
+                         for pkg, (saved_bytes, symbols) in sorted(self.saved.items()))
+
+
+class StubArchive:
+    '''
+    Zip of the rendered stubs, with paths relative to root. Entries are compressed as they're added, only the
+    compressed bytes are held, and written on close sorted by path, with fixed timestamps and permissions, so the same
+    stubs always make the same bytes no matter the render order, worker count or OS. Written to a temp path and moved
+    into place like the IR files.
+
+    zipfile can't write data that's already compressed, so the headers and central directory are written here, the
+    same bytes zipfile writes for them with ZIP_DEFLATED at level 9.
+    '''
+    DATE_TIME = (1980, 1, 1, 0, 0, 0)  # Earliest time zip can store
+    COMPRESS_LEVEL = 9
+
+    def __init__(self, path: str, root: str):
+        self.path = path
+        self.root = root
+        self._entries: dict[str, tuple[zipfile.ZipInfo, bytes]] = {}
+
+    def __enter__(self) -> StubArchive:
+        return self
+
+    def __exit__(self, exc_type, *args) -> None:
+        if exc_type is None:
+            self.close()
+
+    def add(self, path: str, text: str) -> None:
+        name = os.path.relpath(path, self.root).replace(os.sep, '/')
+        data = text.encode()
+        # Raw deflate, like zipfile's compressor
+        compressor = zlib.compressobj(self.COMPRESS_LEVEL, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+
+        info = zipfile.ZipInfo(name, self.DATE_TIME)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.create_system = 3  # Otherwise depends on the OS writing it
+        info.external_attr = 0o644 << 16
+        info.CRC = zlib.crc32(data)
+        info.file_size = len(data)
+        info.compress_size = len(compressed)
+        self._entries[name] = info, compressed
+
+    def close(self) -> None:
+        with open(f'{self.path}.tmp', 'wb') as f:
+            infos = []
+            for name in sorted(self._entries):
+                info, compressed = self._entries[name]
+                info.header_offset = f.tell()
+                if info.header_offset + len(compressed) > zipfile.ZIP64_LIMIT:
+                    raise zipfile.LargeZipFile(f'{self.path} is too big without ZIP64 extensions')
+                f.write(info.FileHeader(zip64=False))
+                f.write(compressed)
+                infos.append(info)
+            self._write_central_dir(f, infos)
+        os.replace(f'{self.path}.tmp', self.path)
 
+    @staticmethod
+    def _write_central_dir(f: BinaryIO, infos: list[zipfile.ZipInfo]) -> None:
+        start = f.tell()
+        for info in infos:
+            filename = info.filename.encode()
+            # Bit 11 marks a UTF-8 name
+            flag_bits = info.flag_bits if filename.isascii() else info.flag_bits | 0x800
+            year, month, day, hour, minute, second = info.date_time
+            dosdate = (year - 1980) << 9 | month << 5 | day
+            dostime = hour << 11 | minute << 5 | second // 2
+            f.write(struct.pack('<4s4B4HL2L5H2L', b'PK\001\002', info.create_version, info.create_system,
+                                info.extract_version, info.reserved, flag_bits, info.compress_type, dostime, dosdate,
+                                info.CRC, info.compress_size, info.file_size, len(filename), 0, 0, 0,
+                                info.internal_attr, info.external_attr, info.header_offset))
+            f.write(filename)
+        end = f.tell()
+        count = len(infos)
+        if count > 0xFFFF:  # Too many entries for the end record, zipfile adds the ZIP64 records then
+            f.write(struct.pack('<4sQ2H2L4Q', b'PK\006\006', 44, 45, 45, 0, 0, count, count, end - start, start))
+            f.write(struct.pack('<4sLQL', b'PK\006\007', 0, end, 1))
+            count = 0xFFFF
+        f.write(struct.pack('<4s4H2LH', b'PK\005\006', 0, 0, count, count, end - start, start, 0))
 
-def write_class_stub(base_dir: str, class_def: ClassDef) -> None:
-    '''Function to write the stub file. Fields need to all be d
-    efined as properties so that game specific versions can subclass them.'''
-    lines = class_def.to_str()
 
-    # Write the file
-    with open(f'{get_pkg_dir(base_dir, class_def.package)}/{class_def.name()}.pyi', 'w') as f:
-        f.write(lines)
+class StubWriter:
+    '''
+    Writes the files for one namespace and records a manifest of their content hashes at manifest_path when given.
+    A full write clears the base dir first. An incremental write compares against the previous manifest, only writes
+    files whose text changed and deletes the files that weren't written this time.
+    With an archive every file is also added to it, and with write_files off only to it, without touching the disk.
+    '''
 
-    # Write import statement to __init__.pyi so that importing something like Core.Object gets the Object class and not the module
-    with open(get_pkg_init(base_dir, class_def.package), 'a') as f:
-        f.write(f'from .{class_def.name()} import {class_def.name()}\n')
+    def __init__(self, base_dir: str, incremental: bool = False, archive: StubArchive | None = None,
+                 write_files: bool = True, manifest_path: str | None = None):
+        self.base_dir = base_dir
+        self.manifest_path = manifest_path
+        self.incremental = incremental and write_files and manifest_path is not None
+        self.archive = archive
+        self.write_files = write_files
+        self.report = WriteReport()
+        self._old_hashes: dict[str, str] = {}
+        self._new_hashes: dict[str, str] = {}
+
+    def begin(self) -> None:
+        if not self.write_files:
+            return
+        # Without a manifest we can't tell which files are ours, so fall back to a full write
+        if self.incremental and os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self._old_hashes = json.load(f)
+        elif os.path.exists(self.base_dir):
+            shutil.rmtree(self.base_dir)
+        os.makedirs(self.base_dir, exist_ok=True)
+
+    def write(self, path: str, text: str) -> None:
+        if self.archive:
+            self.archive.add(path, text)
+        if not self.write_files:
+            self.report.added += 1
+            return
+
+        rel_path = os.path.relpath(path, self.base_dir).replace(os.sep, '/')
+        digest = hashlib.sha256(text.encode()).hexdigest()
+        self._new_hashes[rel_path] = digest
+
+        old_digest = self._old_hashes.get(rel_path)
+        if old_digest == digest and os.path.exists(path):
+            self.report.skipped += 1
+            return
+        if old_digest is None:
+            self.report.added += 1
+        else:
+            self.report.changed += 1
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def finish(self) -> WriteReport:
+        if not self.write_files:
+            return self.report
+
+        for rel_path in sorted(self._old_hashes.keys() - self._new_hashes.keys()):
+            path = f'{self.base_dir}/{rel_path}'
+            if os.path.exists(path):
+                os.remove(path)
+            self.report.deleted += 1
+            # Remove package dirs that no longer have anything in them
+            dir_name = os.path.dirname(path)
+            if os.path.normpath(dir_name) != os.path.normpath(self.base_dir) and os.path.isdir(dir_name) \
+                    and not os.listdir(dir_name):
+                os.rmdir(dir_name)
+
+        if self.manifest_path:
+            os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+            with open(self.manifest_path, 'w') as f:
+                json.dump(self._new_hashes, f, indent=0, sort_keys=True)
+        return self.report
+
+
+def stub_manifest_path(manifest_dir: str, base_dir: str) -> str:
+    """Manifest of the namespace written to base_dir, named after its dir (common, bl2, tps)."""
+    return f'{manifest_dir}/{os.path.basename(os.path.normpath(base_dir))}.json'
+
+
+def render_class_stub(base_dir: str, ctx: Context, class_def: ClassDef,
+                      skipped: list[str] | None = None) -> tuple[str, str]:
+    '''Renders the stub file, returns path and text. Fields need to all be d
+    efined as properties so that game specific versions can subclass them.
+    In delta mode, the text of members left out is added to skipped.'''
+    return f'{get_pkg_dir(base_dir, class_def.package)}/{class_def.name()}.pyi', class_def.to_str(ctx, skipped)
+
+
+def render_class_stubs(base_dir: str, class_defs: list[ClassDef]) -> tuple[list[tuple[str, str]], list[str], tuple[int, int]]:
+    """Render a chunk of classes from one package. Runs in the worker processes in parallel mode.
+    Also returns the members left out in delta mode and the type string cache hits and misses of the chunk, so
+    workers' stats can be added up."""
+    ctx = _worker_contexts[base_dir]
+    hits, misses = TYPE_STR_CACHE.hits, TYPE_STR_CACHE.misses
+    skipped: list[str] = []
+    files = [render_class_stub(base_dir, ctx, class_def, skipped) for class_def in class_defs]
+    return files, skipped, (TYPE_STR_CACHE.hits - hits, TYPE_STR_CACHE.misses - misses)
+
+
+def _init_worker(contexts: dict[str, Context]) -> None:
+    _worker_contexts.clear()
+    _worker_contexts.update(contexts)
 
 
 def class_list_to_all(class_list: list[str]) -> str:
@@ -31,67 +274,185 @@ def class_list_to_all(class_list: list[str]) -> str:
     return '\n'.join(lines)
 
 
-def write_stubs(base_dir: str, class_defs: list[ClassDef]) -> None:
-    packages = set([class_def.package for class_def in class_defs])
+class PackageExports:
+    """Collects the classes exported by one package and renders its __init__.pyi in a single write.
+    Exports keep the order classes were added in unless sort is set."""
 
-    # Clear out old stubs and add __init__.py files
-    if os.path.exists(base_dir):
-        shutil.rmtree(base_dir)
-        os.makedirs(base_dir)
-    for pkg in packages:
-        pkg_dir = get_pkg_dir(base_dir, pkg)
-        os.makedirs(pkg_dir)
-        with open(get_pkg_init(base_dir, pkg), 'w') as f:
-            pass
+    def __init__(self, sort: bool = False):
+        self.sort = sort
+        self._names: list[str] = []
+
+    def add(self, class_name: str) -> None:
+        self._names.append(class_name)
 
-    package_classes = {pkg: [] for pkg in packages}
-    for class_def in class_defs:
-        write_class_stub(base_dir, class_def)
-        package_classes[class_def.package].append(class_def.name())
+    def names(self) -> list[str]:
+        return sorted(self._names) if self.sort else self._names
 
+    def to_str(self) -> str:
+        # Import statements so that importing something like Core.Object gets the Object class and not the module
+        names = self.names()
+        lines = [f'from .{name} import {name}\n' for name in names]
+        lines.append(class_list_to_all(names))
+        return ''.join(lines)
+
+
+def root_exports_str(packages: list[str], package_exports: dict[str, PackageExports]) -> str:
+    """Namespace root __init__. Every class is imported from its own file by name rather than star importing each
+    package, so resolving one name doesn't mean loading every package's exports.
+    Classes named like a package (Engine.Engine) aren't exported, they would replace the package on the root and
+    break every reference going through it (bl2.Engine.Actor). Import those from their package."""
+    names = []
+    lines = []
     for pkg in packages:
-        with open(get_pkg_init(base_dir, pkg), 'a') as f:
-            f.write(class_list_to_all(package_classes[pkg]))
+        for name in package_exports[pkg].names():
+            if name in package_exports:
+                continue
+            lines.append(f'from .{pkg}.{name} import {name}\n')
+            names.append(name)
+    lines.append(class_list_to_all(names))
+    return ''.join(lines)
 
-    with open(f'{base_dir}/__init__.py', 'w') as f:
-        f.writelines([f'from .{pkg} import *\n' for pkg in packages])
 
+def write_all_stubs(namespaces: dict[str, tuple[Context, list[ClassDef]]], workers: int = 1, incremental: bool = False,
+                    sort_exports: bool = False, archive: StubArchive | None = None,
+                    write_files: bool = True, manifest_dir: str | None = None) -> dict[str, WriteReport]:
+    """Write stubs for several namespaces (base_dir -> context and class defs) at once, returns a WriteReport per
+    namespace. The class defs aren't modified, so the same list can be rendered in more than one context.
+    With workers > 1 rendering is sharded by namespace, package and CHUNK_SIZE across a process pool. Everything is
+    written from this process in job order, so output matches the serial path.
+    sort_exports sorts package __all__ lists and the root imports by name instead of class def order.
+    Files are also added to archive when given, write_files=False only writes the archive.
+    Incremental writes need manifest_dir, where each namespace's manifest is kept (see stub_manifest_path)."""
+    writers: dict[str, StubWriter] = {}
+    namespace_exports: dict[str, dict[str, PackageExports]] = {}
+    jobs: list[tuple[str, list[ClassDef]]] = []
+    contexts = {base_dir: ctx for base_dir, (ctx, _) in namespaces.items()}
+    for base_dir, (_, class_defs) in namespaces.items():
+        writers[base_dir] = StubWriter(base_dir, incremental, archive, write_files,
+                                       stub_manifest_path(manifest_dir, base_dir) if manifest_dir else None)
+        writers[base_dir].begin()
+        namespace_exports[base_dir] = {}
 
-if __name__ == '__main__':
+        package_classes: dict[str, list[ClassDef]] = defaultdict(list)
+        for class_def in class_defs:
+            package_classes[class_def.package].append(class_def)
+        for pkg, pkg_class_defs in package_classes.items():
+            namespace_exports[base_dir][pkg] = PackageExports(sort_exports)
+            for i in range(0, len(pkg_class_defs), CHUNK_SIZE):
+                jobs.append((base_dir, pkg_class_defs[i:i + CHUNK_SIZE]))
 
-    with open(f'{CLASS_DEF_DATA_DIR}/common_class_defs_adj.pkl', 'rb') as f:
-        common_class_defs: list[ClassDef] = pickle.load(f)
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(contexts,))
+        results = executor.map(render_class_stubs, *zip(*jobs))
+    else:
+        executor = None
+        _init_worker(contexts)
+        results = (render_class_stubs(base_dir, class_defs) for base_dir, class_defs in jobs)
+    try:
+        for (base_dir, class_defs), (files, skipped, (hits, misses)) in zip(jobs, results):
+            if executor:
+                TYPE_STR_CACHE.hits += hits
+                TYPE_STR_CACHE.misses += misses
+            if skipped:
+                writers[base_dir].report.add_saved(class_defs[0].package, skipped)
+            for class_def, (path, text) in zip(class_defs, files):
+                writers[base_dir].write(path, text)
+                namespace_exports[base_dir][class_def.package].add(class_def.name())
+    finally:
+        if executor:
+            executor.shutdown()
 
-    with open(f'{CLASS_DEF_DATA_DIR}/tps_class_defs_adj.pkl', 'rb') as f:
-        tps_class_defs: list[ClassDef] = pickle.load(f)
+    reports = {}
+    for base_dir, package_exports in namespace_exports.items():
+        writer = writers[base_dir]
+        packages = sorted(package_exports) if sort_exports else list(package_exports)
+        for pkg in packages:
+            writer.write(get_pkg_init(base_dir, pkg), package_exports[pkg].to_str())
+        writer.write(f'{base_dir}/__init__.py', root_exports_str(packages, package_exports))
+        reports[base_dir] = writer.finish()
+    return reports
 
-    with open(f'{CLASS_DEF_DATA_DIR}/bl2_class_defs_adj.pkl', 'rb') as f:
-        bl2_class_defs: list[ClassDef] = pickle.load(f)
 
+def write_stubs(base_dir: str, ctx: Context, class_defs: list[ClassDef], workers: int = 1, incremental: bool = False,
+                sort_exports: bool = False) -> WriteReport:
+    return write_all_stubs({base_dir: (ctx, class_defs)}, workers, incremental, sort_exports,
+                           manifest_dir=MANIFEST_DIR)[base_dir]
 
-    write_stubs(COMMON_DIR, common_class_defs)
-    write_stubs(TPS_DIR, tps_class_defs)
-    write_stubs(BL2_DIR, bl2_class_defs)
 
-    # type_defs.pyi needed as reference for OutParam and AttributeProperty
-    with open(f'{PYSTUBS_DIR}/type_defs.pyi', 'w') as f:
-        f.write(textwrap.dedent(
-        '''\
-        from typing import Generic, TypeVar
+def write_game_stubs(workers: int = 1, incremental: bool = False, sort_exports: bool = False, merge: bool = False,
+                     delta: bool = False, compact: bool = False, zip_path: str | None = None,
+                     write_files: bool = True, index_path: str | None = None) -> dict[str, WriteReport]:
+    """Write the common, TPS and BL2 stubs and type_defs.pyi from the IR files in CLASS_DEF_DATA_DIR, optionally to a
+    zip too, and the symbol index of the same class defs to index_path. Returns the WriteReport of each namespace."""
+    archive = StubArchive(zip_path, PYSTUBS_DIR) if zip_path else None
 
-        # Create a generic Out type to indicate out parameters
-        T = TypeVar('T')
+    tps_class_defs = read_ir(f'{CLASS_DEF_DATA_DIR}/TPS_class_defs.ir')
+    bl2_class_defs = read_ir(f'{CLASS_DEF_DATA_DIR}/BL2_class_defs.ir')
+    if merge:
+        common_class_defs = create_common_class_defs(bl2_class_defs, tps_class_defs)
+    else:
+        common_class_defs = read_ir(f'{CLASS_DEF_DATA_DIR}/common_class_defs.ir')
+    common_names = NameResolver.from_class_defs(common_class_defs)
+    common_defs = {class_def.full_name(): class_def for class_def in common_class_defs} if delta else None
 
+    reports = write_all_stubs({COMMON_DIR: (Context(Game.COMMON, common_names, compact=compact), common_class_defs),
+                               TPS_DIR: (Context(Game.TPS, common_names, common_defs, compact), tps_class_defs),
+                               BL2_DIR: (Context(Game.BL2, common_names, common_defs, compact), bl2_class_defs)},
+                              workers, incremental, sort_exports, archive, write_files, MANIFEST_DIR)
 
-        class OutParam(Generic[T]):
-            """
-            Indicates that a parameter is an 'out' parameter.
-            """
+    # type_defs.pyi needed as reference for OutParam and AttributeProperty
+    if write_files:
+        with open(f'{PYSTUBS_DIR}/type_defs.pyi', 'w') as f:
+            f.write(TYPE_DEFS)
+    if archive:
+        archive.add(f'{PYSTUBS_DIR}/type_defs.pyi', TYPE_DEFS)
+        archive.close()
+    if index_path:
+        write_symbol_index(index_path, {Game.COMMON: common_class_defs, Game.TPS: tps_class_defs,
+                                        Game.BL2: bl2_class_defs})
+    return reports
 
 
-        class AttributeProperty(Generic[T]):
-            """
-            Indicates that the property is an attribute property.
-            """
-        '''
-        ))
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write stubs from the common and game class def IR files.')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='Number of render processes. 0 uses every core, 1 (default) renders serially.')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='Only write changed files and delete removed ones instead of clearing the output dirs.')
+    parser.add_argument('-s', '--sort-exports', action='store_true',
+                        help='Sort package exports by name so output order does not depend on class def order.')
+    parser.add_argument('-m', '--merge', action='store_true',
+                        help='Merge the game class defs here instead of reading common_class_defs.ir.')
+    parser.add_argument('-d', '--delta', action='store_true',
+                        help='Leave members out of game stubs when they are the same as the common class they inherit.')
+    parser.add_argument('-c', '--compact', action='store_true',
+                        help='Write functions with one copy of their docstring and no __init__.')
+    parser.add_argument('-z', '--zip', help='Also write the stubs to this zip, sorted and with fixed timestamps.')
+    parser.add_argument('--zip-only', action='store_true', help='With --zip, only write the zip and no stub files.')
+    parser.add_argument('--index', help='Also write a SQLite symbol index of the class defs to this path.')
+    parser.add_argument('--check', action='store_true',
+                        help='Check that every reference in the written stubs resolves, exits with an error if not.')
+    args = parser.parse_args()
+    workers = args.workers or os.cpu_count() or 1
+    if args.zip_only and not args.zip:
+        parser.error('--zip-only needs --zip')
+    if args.check and args.zip_only:
+        parser.error('--check reads the written stub files, it does not work with --zip-only')
+    reports = write_game_stubs(workers, args.incremental, args.sort_exports, args.merge, args.delta, args.compact,
+                               args.zip, not args.zip_only, args.index)
+    for base_dir, report in reports.items():
+        print(f'{base_dir}: {report}')
+        if report.saved:
+            print(report.saved_str())
+    print(TYPE_STR_CACHE.stats_str())
+    if args.zip:
+        print(f'{args.zip}: {os.path.getsize(args.zip)} bytes')
+    if args.index:
+        print(f'{args.index}: {os.path.getsize(args.index)} bytes')
+    if args.check:
+        errors = check_stub_tree(PYSTUBS_DIR, [os.path.basename(base_dir) for base_dir in reports])
+        for error in errors:
+            print(error)
+        print(f'Check: {len(errors)} problems')
+        if errors:
+            raise SystemExit(1)